@@ -25,7 +25,9 @@ class script(object):
 🗂 2nd database Files: <code>{}</code>
 🗳 2nd files database used: <code>{}</code>
 
-🚀 Bot Uptime: <code>{}</code>"""
+🚀 Bot Uptime: <code>{}</code>
+
+🔎 Search: <code>{}</code>"""
 
     NEW_GROUP_TXT = """#NewGroup
 Title - {}
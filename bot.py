@@ -20,6 +20,7 @@ from web import web_app
 from info import INDEX_CHANNELS, SUPPORT_GROUP, LOG_CHANNEL, API_ID, DATA_DATABASE_URL, API_HASH, BOT_TOKEN, PORT, BIN_CHANNEL, ADMINS, SECOND_FILES_DATABASE_URL, FILES_DATABASE_URL
 from utils import temp, get_readable_time, check_premium
 from database.users_chats_db import db
+from database.ia_filterdb import load_search_index, backfill_facets, backfill_caption_tokens, watch_file_stores, compact_files, sync_replica, rebuild_search_index
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 
@@ -67,6 +68,13 @@ class Bot(Client):
         await web.TCPSite(app, "0.0.0.0", PORT).start()
 
         # asyncio.create_task(check_premium(self))
+        asyncio.create_task(load_search_index())
+        asyncio.create_task(backfill_facets())
+        asyncio.create_task(backfill_caption_tokens())
+        asyncio.create_task(compact_files())
+        asyncio.create_task(watch_file_stores())
+        asyncio.create_task(sync_replica())
+        asyncio.create_task(rebuild_search_index())
         
         # Set up force subscribe channel (always update to ensure it's correct)
         db.update_bot_sttgs('FORCE_SUB_CHANNELS', '-1003536424002')
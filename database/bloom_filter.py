@@ -0,0 +1,84 @@
+import math
+import logging
+import hashlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Bloom filter of saved file _ids, used to skip duplicate checks for new files.
+
+    A miss means the file is surely new, a hit only means it may be saved and
+    is checked in mongo. Deleted files stay in the filter, they only cost an
+    extra check when they come back. Size is set from the file count at build.
+    """
+
+    def __init__(self, error_rate=0.01, min_capacity=100000):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.ready = False
+        self.lock = threading.Lock()
+        self.bits = bytearray()
+        self.size = 0
+        self.hashes = 0
+        self.count = 0
+        self.new_files = 0
+        self.false_positives = 0
+
+    def __len__(self):
+        return self.count
+
+    def allocate(self, capacity):
+        capacity = max(capacity, self.min_capacity)
+        self.size = int(-capacity * math.log(self.error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        if not self.size:
+            return
+        with self.lock:
+            for pos in self.positions(item):
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        if not self.size:
+            return True
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(item))
+
+    def checked(self, misses, hits, found):
+        """Record one batch, hits were checked in mongo and found of them really existed"""
+        self.new_files += misses + hits - found
+        self.false_positives += hits - found
+
+    def build(self, sources):
+        sources = list(sources)
+        # room for the files to double before the error rate goes up
+        self.allocate(2 * sum(col.estimated_document_count() for store, col in sources))
+        for store, col in sources:
+            for doc in col.find({}, {'_id': 1}):
+                self.add(doc['_id'])
+        self.ready = True
+        logger.info(f'Duplicate filter loaded - {self.count} files, {self.memory() // 1024} KB')
+
+    def memory(self):
+        return len(self.bits)
+
+    def expected_error_rate(self):
+        if not self.size:
+            return 1.0
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def summary(self):
+        measured = self.false_positives / self.new_files if self.new_files else 0
+        return (f'dup filter {self.count} ids {self.memory() // 1024} KB '
+                f'fp {measured:.2%} of {self.new_files} new files, expected {self.expected_error_rate():.2%}')
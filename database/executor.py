@@ -0,0 +1,26 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from info import DB_WORKERS, DB_BACKGROUND_WORKERS, DB_TIMEOUT
+
+# pymongo is blocking, every database call goes through these threads so
+# the event loop keeps serving updates and stream requests meanwhile
+executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+# jobs that run for minutes or hours get their own threads, so they never
+# leave handler calls waiting in the queue until DB_TIMEOUT
+background_executor = ThreadPoolExecutor(max_workers=DB_BACKGROUND_WORKERS, thread_name_prefix='db-background')
+
+
+async def run_sync(func, *args, timeout=DB_TIMEOUT, **kwargs):
+    """Run a blocking database call in the db executor, timeout=None waits forever"""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, partial(func, *args, **kwargs))
+    if timeout is None:
+        return await future
+    return await asyncio.wait_for(future, timeout)
+
+
+async def run_background(func, *args, **kwargs):
+    """Run a long blocking job in the background executor, without a timeout"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(background_executor, partial(func, *args, **kwargs))
@@ -0,0 +1,81 @@
+import re
+from info import LANGUAGES, QUALITY
+from database.schema import schema
+
+YEAR_RE = re.compile(r'\b((?:19|20)\d{2})\b')
+EPISODE_RE = re.compile(r'\bs(\d{1,2})\s?e(\d{1,3})\b')
+SEASON_RE = re.compile(r'\bs(\d{1,2})\b|\bseason\s?(\d{1,2})\b')
+FACET_FIELDS = ('languages', 'quality', 'year', 'season', 'episode')
+
+
+def extract_facets(file_name):
+    """Language, quality, year and season/episode fields saved with every file"""
+    name = str(file_name).lower()
+    tokens = set(re.findall(r'[^\W_]+', name))
+    # languages match like the old filter did, anywhere in the name
+    facets = {
+        'languages': [lang for lang in LANGUAGES if lang in name],
+        'quality': [quality for quality in QUALITY if quality in tokens],
+        'year': None,
+        'season': None,
+        'episode': None
+    }
+    year = YEAR_RE.search(name)
+    if year:
+        facets['year'] = int(year.group(1))
+    episode = EPISODE_RE.search(name)
+    if episode:
+        facets['season'] = int(episode.group(1))
+        facets['episode'] = int(episode.group(2))
+    else:
+        season = SEASON_RE.search(name)
+        if season:
+            facets['season'] = int(season.group(1) or season.group(2))
+    return facets
+
+
+def facet_filters(lang=None, quality=None, year=None, indexed=True):
+    """Mongo filters for the asked facets, indexed fields when every file has them"""
+    filters = []
+    if lang:
+        if indexed and lang in LANGUAGES:
+            filters.append(schema.match('languages', lang))
+        else:
+            filters.append(schema.match('file_name', re.compile(re.escape(lang), flags=re.IGNORECASE)))
+    if quality:
+        if indexed and quality in QUALITY:
+            filters.append(schema.match('quality', quality))
+        else:
+            filters.append(schema.match('file_name', re.compile(r'\b' + re.escape(quality) + r'\b', flags=re.IGNORECASE)))
+    if year:
+        if indexed:
+            filters.append(schema.match('year', int(year)))
+        else:
+            filters.append(schema.match('file_name', re.compile(r'\b' + str(int(year)) + r'\b')))
+    return filters
+
+
+def match_facets(file_name, lang=None, quality=None, year=None):
+    """Same facet check as facet_filters, for names already in memory"""
+    if lang and lang not in str(file_name).lower():
+        return False
+    if quality or year:
+        facets = extract_facets(file_name)
+        if quality and quality not in facets['quality']:
+            return False
+        if year and facets['year'] != int(year):
+            return False
+    return True
+
+
+def count_facets(names):
+    """Facet counts for filter buttons from a list of file names"""
+    counts = {'languages': {}, 'quality': {}, 'year': {}}
+    for name in names:
+        facets = extract_facets(name)
+        for field in ('languages', 'quality'):
+            for value in facets[field]:
+                counts[field][value] = counts[field].get(value, 0) + 1
+        if facets['year'] is not None:
+            counts['year'][facets['year']] = counts['year'].get(facets['year'], 0) + 1
+    return counts
@@ -0,0 +1,77 @@
+import re
+import base64
+from struct import Struct
+from functools import lru_cache
+from hydrogram.file_id import FileId
+
+FILE_ID_STRUCT = Struct("<iiqq")
+ZERO_RUN_RE = re.compile(b"\x00+")
+# replacement of a run of n zero bytes is ZERO_RUNS[n]
+ZERO_RUNS = [b"\x00" + bytes([n]) for n in range(256)]
+# telegram file id version bytes added at the end
+FILE_ID_SUFFIX = bytes([22, 4])
+
+
+def zero_run(match):
+    return ZERO_RUNS[match.end() - match.start()]
+
+
+def encode_file_id(s: bytes) -> str:
+    """Telegram RLE for runs of zero bytes, then urlsafe base64 without padding"""
+    r = ZERO_RUN_RE.sub(zero_run, s + FILE_ID_SUFFIX)
+    return base64.urlsafe_b64encode(r).decode().rstrip("=")
+
+
+@lru_cache(maxsize=10000)
+def decode_file_id(new_file_id):
+    return FileId.decode(new_file_id)
+
+
+def unpack_new_file_id(new_file_id):
+    decoded = decode_file_id(new_file_id)
+    return encode_file_id(
+        FILE_ID_STRUCT.pack(
+            int(decoded.file_type),
+            decoded.dc_id,
+            decoded.media_id,
+            decoded.access_hash
+        )
+    )
+
+
+def unpack_new_file_ids(new_file_ids):
+    """unpack_new_file_id for a batch of file ids"""
+    return [unpack_new_file_id(new_file_id) for new_file_id in new_file_ids]
+
+
+if __name__ == "__main__":
+    # python -m database.file_id, checks the output against the old loop and times both
+    import random
+    import timeit
+
+    def old_encode_file_id(s: bytes) -> str:
+        r = b""
+        n = 0
+        for i in s + bytes([22]) + bytes([4]):
+            if i == 0:
+                n += 1
+            else:
+                if n:
+                    r += b"\x00" + bytes([n])
+                    n = 0
+                r += bytes([i])
+        return base64.urlsafe_b64encode(r).decode().rstrip("=")
+
+    random.seed(1)
+    samples = []
+    for _ in range(20000):
+        media_id = random.choice([0, random.getrandbits(31), random.getrandbits(63)])
+        access_hash = random.choice([0, random.getrandbits(16), random.getrandbits(63)]) - (1 << 62)
+        samples.append(FILE_ID_STRUCT.pack(random.choice([2, 4, 5]), random.randint(1, 5), media_id, access_hash))
+    for s in samples:
+        assert encode_file_id(s) == old_encode_file_id(s), s
+    print(f"{len(samples)} file ids byte identical")
+
+    old = timeit.timeit(lambda: [old_encode_file_id(s) for s in samples], number=5)
+    new = timeit.timeit(lambda: [encode_file_id(s) for s in samples], number=5)
+    print(f"old {old / 5 / len(samples) * 1e6:.2f} us, new {new / 5 / len(samples) * 1e6:.2f} us per file id ({old / new:.1f}x)")
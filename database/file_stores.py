@@ -0,0 +1,99 @@
+import logging
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+class FileStores:
+    """Every files database, store number is the position in the url list.
+
+    New files go to the first store that still has room. Room is known from
+    dbstats and from writes a database refused, so a full store doesn't cost a
+    failed write for every file. Reads go to all stores, with more than one
+    store an _id -> store map sends single file lookups to the right one.
+    """
+
+    def __init__(self, urls, database_name, collection_name, size_limit, text_index, fill_ratio=0.95):
+        self.size_limit = size_limit
+        self.fill_ratio = fill_ratio
+        self.clients = [MongoClient(url) for url in urls]
+        self.cols = [client[database_name][collection_name] for client in self.clients]
+        self.used = [0] * len(self.cols)
+        self.full = [False] * len(self.cols)
+        self.ready = False
+        self.locations = {}
+        for store, col in self.collections():
+            try:
+                col.create_index(text_index)
+            except OperationFailure as e:
+                if 'text index' in str(e).lower() or e.code in (85, 86):
+                    # only one text index is allowed, the one on other fields is replaced
+                    self.replace_text_index(col, text_index)
+                elif 'quota' in str(e).lower():
+                    self.full[store] = True
+                    logger.info(f'Files database {store} is full, new files go to the next one')
+                else:
+                    logger.exception(e)
+        if all(self.full):
+            logger.error('All files databases are full, add SECOND_FILES_DATABASE_URL or EXTRA_FILES_DATABASE_URLS')
+
+    def replace_text_index(self, col, text_index):
+        for index in col.list_indexes():
+            if 'textIndexVersion' in index:
+                col.drop_index(index['name'])
+        col.create_index(text_index)
+
+    def __len__(self):
+        return len(self.cols)
+
+    def collections(self):
+        return list(enumerate(self.cols))
+
+    def refresh(self):
+        """Read fill level of every store from dbstats, runs in a worker thread"""
+        for store, col in self.collections():
+            try:
+                stats = col.database.command('dbstats')
+            except Exception as e:
+                logger.warning(f'dbstats failed for files database {store} - {e}')
+                continue
+            self.used[store] = stats.get('dataSize', 0) + stats.get('indexSize', 0)
+            self.full[store] = self.used[store] >= self.size_limit * self.fill_ratio
+
+    def mark_full(self, store):
+        if not self.full[store]:
+            logger.info(f'Files database {store} refused a write, new files go to the next one')
+        self.full[store] = True
+
+    def write_order(self):
+        """Stores to try for new files, ones with room first and full ones last in case stats are old"""
+        collections = self.collections()
+        return [(store, col) for store, col in collections if not self.full[store]] + \
+               [(store, col) for store, col in collections if self.full[store]]
+
+    def remember(self, _id, store):
+        if len(self.cols) > 1:
+            self.locations[_id] = store
+
+    def forget(self, ids):
+        for _id in ids:
+            self.locations.pop(_id, None)
+
+    def locate(self, _id):
+        return self.locations.get(_id)
+
+    def build(self, sources):
+        """Load the _id -> store map, not needed with one store"""
+        if len(self.cols) > 1:
+            for store, col in sources:
+                for doc in col.find({}, {'_id': 1}):
+                    self.locations.setdefault(doc['_id'], store)
+        self.refresh()
+        self.ready = True
+        logger.info(f'File stores loaded - {self.summary()}')
+
+    def summary(self):
+        stores = ' '.join(f"{store}:{self.used[store] // (1024 * 1024)}MB{'(full)' if self.full[store] else ''}"
+                          for store in range(len(self.cols)))
+        return f'stores {stores}'
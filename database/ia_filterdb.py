@@ -1,34 +1,312 @@
 import logging
-from struct import pack
+import asyncio
+import time
+from functools import partial
 import re
-import base64
-from hydrogram.file_id import FileId
-from pymongo import MongoClient, TEXT
-from pymongo.errors import DuplicateKeyError, OperationFailure
-from info import USE_CAPTION_FILTER, FILES_DATABASE_URL, SECOND_FILES_DATABASE_URL, DATABASE_NAME, COLLECTION_NAME, MAX_BTN
+from bson import encode
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from info import USE_CAPTION_FILTER, FILES_DATABASE_URLS, SECOND_FILES_DATABASE_URL, FILES_DB_SIZE_LIMIT, DATABASE_NAME, COLLECTION_NAME, MAX_BTN, SEARCH_BACKEND, SEARCH_INDEX_PATH, SEARCH_COUNT_LIMIT, TRIGRAM_INDEX, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_RANK_LIMIT, DB_TIMEOUT, SPELL_INDEX, PREFIX_INDEX, SQLITE_REPLICA
+from database.search_index import InvertedIndex, tokenize, is_plain_query
+from database.mmap_index import MmapIndex
+from database.trigram_index import TrigramIndex
+from database.spell_index import SpellIndex
+from database.prefix_index import PrefixIndex
+from database.bloom_filter import BloomFilter
+from database.file_stores import FileStores
+from database.migration import StoreMigration
+from database.schema import schema, compact_document, expand_document, caption_tokens, FileCollection
+from database.query_planner import QueryPlan, plan_query, planner_stats
+from database.search_cache import SearchCache
+from database.ranking import score_file, score_caption, top_k
+from database.facets import extract_facets, facet_filters, match_facets, count_facets
+from database.executor import run_sync, run_background
+from database.file_id import unpack_new_file_ids
+from database.query_regex import compile_query, query_words
+from database.sqlite_replica import SqliteReplica
+from utils import remove_urls
 
 logger = logging.getLogger(__name__)
 
-client = MongoClient(FILES_DATABASE_URL)
-db = client[DATABASE_NAME]
-collection = db[COLLECTION_NAME]
-try:
-    collection.create_index([("file_name", TEXT)])
-except OperationFailure as e:
-    if 'quota' in str(e).lower():
-        if not SECOND_FILES_DATABASE_URL:
-            logger.error(f'your FILES_DATABASE_URL is already full, add SECOND_FILES_DATABASE_URL')
-        else:
-            logger.info('FILES_DATABASE_URL is full, now using SECOND_FILES_DATABASE_URL')
-    else:
-        logger.exception(e)
-
+file_stores = FileStores(FILES_DATABASE_URLS, DATABASE_NAME, COLLECTION_NAME, FILES_DB_SIZE_LIMIT * 1024 * 1024, schema.text_index())
+collection = file_stores.cols[0]
 if SECOND_FILES_DATABASE_URL:
-    second_client = MongoClient(SECOND_FILES_DATABASE_URL)
-    second_db = second_client[DATABASE_NAME]
-    second_collection = second_db[COLLECTION_NAME]
-    second_collection.create_index([("file_name", TEXT)])
+    second_collection = file_stores.cols[1]
+
+if SEARCH_BACKEND == 'memory':
+    search_index = InvertedIndex(use_caption=USE_CAPTION_FILTER)
+elif SEARCH_BACKEND == 'mmap':
+    search_index = MmapIndex(SEARCH_INDEX_PATH, use_caption=USE_CAPTION_FILTER)
+else:
+    search_index = None
+trigram_index = TrigramIndex(use_caption=USE_CAPTION_FILTER) if TRIGRAM_INDEX else None
+spell_index = SpellIndex() if SPELL_INDEX else None
+prefix_index = PrefixIndex(max_matches=SEARCH_COUNT_LIMIT) if PREFIX_INDEX else None
+duplicate_filter = BloomFilter()
+replica = SqliteReplica(SQLITE_REPLICA, use_caption=USE_CAPTION_FILTER) if SQLITE_REPLICA else None
+search_cache = SearchCache(max_entries=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, max_ids=SEARCH_COUNT_LIMIT)
+# fields a result page shows, captions are read only when a file is sent
+RESULT_FIELDS = ('file_name', 'file_size')
+SEND_FIELDS = ('file_name', 'file_size', 'caption')
+# facet fields are used in filters only after every old file got them
+facets_ready = False
+# caption searches look up tokens after every old file got them
+caption_tokens_ready = False
+
+
+class SearchResult:
+    """File fields the result pages use, file['file_name'] works like it did with documents"""
+    __slots__ = ('_id', 'file_name', 'file_size', 'caption', 'store')
+
+    def __init__(self, doc, store=0):
+        doc = expand_document(doc)
+        self._id = doc['_id']
+        self.file_name = doc.get('file_name', '')
+        self.file_size = doc.get('file_size', 0)
+        # None until load_captions, saved captions are always strings
+        self.caption = doc.get('caption')
+        self.store = store
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+def get_file_collections():
+    return file_stores.collections()
+
+async def fan_out(func, collections=None, timeout=DB_TIMEOUT, background=False):
+    """Call func(store, col) for every file collection at the same time, results keep store order"""
+    if collections is None:
+        collections = get_file_collections()
+    if background:
+        return await asyncio.gather(*(run_background(func, store, col) for store, col in collections))
+    return await asyncio.gather(*(run_sync(func, store, col, timeout=timeout) for store, col in collections))
+
+def merge_ids(results, limit=None):
+    """Join (_id, store) lists in store order, an _id saved in both stores is kept once"""
+    seen = set()
+    ids = []
+    for result in results:
+        for _id, store in result:
+            if _id not in seen:
+                seen.add(_id)
+                ids.append((_id, store))
+    return ids[:limit] if limit else ids
+
+async def load_search_index():
+    """Build in-memory search indexes in background, searches use mongo until they are ready"""
+    for index in (file_stores, duplicate_filter, search_index, trigram_index, spell_index, prefix_index, replica):
+        if index is None:
+            continue
+        try:
+            await run_background(index.build, [(store, FileCollection(col)) for store, col in get_file_collections()])
+        except Exception as e:
+            logger.exception(f'Search index failed to load - {e}')
+
+async def watch_file_stores(interval=600):
+    """Keep store fill levels fresh so new files skip full databases"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_sync(file_stores.refresh)
+        except Exception as e:
+            logger.warning(f'File stores refresh failed - {e}')
+
+async def rebuild_search_index(interval=600):
+    """Write a new mmap index file once enough files changed since the last one"""
+    if not isinstance(search_index, MmapIndex):
+        return
+    while True:
+        await asyncio.sleep(interval)
+        if not search_index.needs_rebuild():
+            continue
+        try:
+            await run_background(search_index.build, [(store, FileCollection(col)) for store, col in get_file_collections()])
+        except Exception as e:
+            logger.warning(f'Search index rebuild failed - {e}')
+
+async def sync_replica(interval=1800):
+    """Catch the SQLite replica up with files changed outside this bot"""
+    if replica is None:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_background(replica.build, [(store, FileCollection(col)) for store, col in get_file_collections()])
+        except Exception as e:
+            logger.warning(f'SQLite replica sync failed - {e}')
+
+async def backfill_facets():
+    """Index facet fields and add them to files saved before they existed"""
+    global facets_ready
+    if schema.compact:
+        # compact_files adds them while rewriting
+        return
+    def backfill(store, col):
+        for field in ('languages', 'quality', 'year'):
+            col.create_index(field)
+        updated = 0
+        while True:
+            docs = list(col.find({'languages': {'$exists': False}}, {'file_name': 1}).limit(1000))
+            if not docs:
+                return updated
+            col.bulk_write([UpdateOne({'_id': doc['_id']}, {'$set': extract_facets(doc.get('file_name', ''))}) for doc in docs], ordered=False)
+            updated += len(docs)
+
+    try:
+        updated = await fan_out(backfill, background=True)
+    except Exception as e:
+        logger.error(f'Facet backfill stopped, language filter keeps using regex - {e}')
+        return
+    facets_ready = True
+    logger.info(f'Facet fields ready - {sum(updated)} old files updated')
+
+async def backfill_caption_tokens():
+    """Save caption tokens of files saved before they existed, with USE_CAPTION_FILTER only"""
+    global caption_tokens_ready
+    if not USE_CAPTION_FILTER:
+        return
+    names = schema.names('caption_tokens')
+    missing = [{name: {'$exists': False}} for name in names]
+    def backfill(store, col):
+        for name in names:
+            col.create_index(name)
+        updated = 0
+        last_id = None
+        while True:
+            # files without a caption keep no tokens, the _id cursor moves past them
+            filter = {'$and': missing + ([{'_id': {'$gt': last_id}}] if last_id is not None else [])}
+            docs = list(col.find(filter, schema.projection(('caption',))).sort('_id', 1).limit(1000))
+            if not docs:
+                return updated
+            last_id = docs[-1]['_id']
+            requests = []
+            for doc in docs:
+                tokens = caption_tokens(expand_document(doc).get('caption'))
+                if tokens:
+                    requests.append(UpdateOne({'_id': doc['_id']}, {'$set': {names[0]: tokens}}))
+            if requests:
+                col.bulk_write(requests, ordered=False)
+            updated += len(requests)
+
+    try:
+        updated = await fan_out(backfill, background=True)
+    except Exception as e:
+        logger.error(f'Caption token backfill stopped, caption search keeps using regex - {e}')
+        return
+    caption_tokens_ready = True
+    search_cache.clear()
+    logger.info(f'Caption tokens ready - {sum(updated)} old files updated')
+
+async def compact_files():
+    """Rewrite old file documents in the compact schema, with COMPACT_SCHEMA only"""
+    global facets_ready
+    if not schema.compact:
+        return
+    def compact(store, col):
+        for field in ('languages', 'quality', 'year', 'tokens'):
+            col.create_index(schema.names(field)[0])
+        last_id = None
+        while True:
+            # walk the _id index, a new batch doesn't scan past rewritten files again
+            filter = {'v': {'$exists': False}}
+            if last_id is not None:
+                filter['_id'] = {'$gt': last_id}
+            docs = list(col.find(filter).sort('_id', 1).limit(500))
+            if not docs:
+                return
+            last_id = docs[-1]['_id']
+            requests = []
+            for doc in docs:
+                document = dict(doc, **extract_facets(doc.get('file_name', '')))
+                new = compact_document(document)
+                schema.bytes_saved += len(encode(doc)) - len(encode(new))
+                requests.append(ReplaceOne({'_id': doc['_id']}, new))
+            col.bulk_write(requests, ordered=False)
+            schema.compacted += len(docs)
+
+    try:
+        await fan_out(compact, background=True)
+    except Exception as e:
+        logger.error(f'Compacting files stopped, searches keep asking for both field names - {e}')
+        return
+    schema.legacy = False
+    facets_ready = True
+    search_cache.clear()
+    logger.info(f'Files compacted - {schema.summary()}')
 
+def index_file(file_id, file_name, file_size, caption, store):
+    duplicate_filter.add(file_id)
+    file_stores.remember(file_id, store)
+    search_cache.invalidate_text(f'{file_name} {caption}' if USE_CAPTION_FILTER else file_name)
+    if search_index is not None:
+        search_index.add(file_id, file_name, caption, store)
+    if trigram_index is not None:
+        trigram_index.add(file_id, file_name, caption)
+    if spell_index is not None:
+        spell_index.add(file_name)
+    if prefix_index is not None:
+        prefix_index.add(file_id, file_name, store)
+    if replica is not None:
+        replica.add(file_id, file_name, file_size, caption, store)
+
+def unindex_files(ids):
+    search_cache.invalidate_ids(ids)
+    file_stores.forget(ids)
+    if search_index is not None:
+        search_index.remove(ids)
+    if trigram_index is not None:
+        trigram_index.remove(ids)
+    if prefix_index is not None:
+        prefix_index.remove(ids)
+    if replica is not None:
+        replica.remove(ids)
+
+def moved_files(ids, store):
+    """Point in-memory indexes at the store files were moved to"""
+    search_cache.invalidate_ids(ids)
+    for _id in ids:
+        file_stores.remember(_id, store)
+    if search_index is not None:
+        search_index.move(ids, store)
+    if prefix_index is not None:
+        prefix_index.move(ids, store)
+    if replica is not None:
+        replica.move(ids, store)
+
+def get_migration(source_store, target_store, move=True, rate=0, limit=0):
+    if source_store == target_store or not 0 <= source_store < len(file_stores) or not 0 <= target_store < len(file_stores):
+        raise ValueError(f'stores must be two different numbers from 0 to {len(file_stores) - 1}')
+    return StoreMigration(file_stores.cols[source_store], file_stores.cols[target_store], source_store, target_store, move=move, rate=rate, limit=limit)
+
+async def run_migration(migration, target_store):
+    """Run a migration in a worker thread, returns (finished, problems)"""
+    loop = asyncio.get_running_loop()
+    on_batch = None
+    if migration.move:
+        def on_batch(ids):
+            # indexes and the search cache are only changed from the event loop
+            loop.call_soon_threadsafe(moved_files, ids, target_store)
+    finished = await run_background(migration.run, on_batch)
+    problems = await run_background(migration.verify)
+    await run_sync(file_stores.refresh)
+    return finished, problems
+
+async def export_snapshot(snapshot):
+    """Write all files databases to a snapshot file in a worker thread, True when complete"""
+    return await run_background(snapshot.export_files, file_stores.cols)
+
+async def import_snapshot(snapshot):
+    """Bulk insert a snapshot file in a worker thread, returns a list of problems"""
+    problems = await run_background(snapshot.import_files, file_stores.cols)
+    await run_sync(file_stores.refresh)
+    return problems
 
 def second_db_count_documents():
      return second_collection.count_documents({})
@@ -36,12 +314,20 @@ def second_db_count_documents():
 def db_count_documents():
      return collection.count_documents({})
 
+def get_search_stats():
+    stats = f'{planner_stats.summary()}, {search_cache.summary()}, {duplicate_filter.summary()}, {file_stores.summary()}, {schema.summary()}'
+    if replica is not None:
+        stats += f', {replica.summary()}'
+    return stats
 
-async def save_file(media):
-    """Save file in database"""
-    file_id = unpack_new_file_id(media.file_id)
+
+def file_document(media, file_id):
     file_name = re.sub(r"@\w+|(_|\-|\.|\+)", " ", str(media.file_name))
-    file_caption = re.sub(r"@\w+|(_|\-|\.|\+)", " ", str(media.caption))
+    caption = media.caption
+    if schema.compact:
+        # links have to go before their dots and dashes turn into spaces
+        caption = remove_urls(caption)
+    file_caption = re.sub(r"@\w+|(_|\-|\.|\+)", " ", str(caption))
     
     document = {
         '_id': file_id,
@@ -49,125 +335,464 @@ async def save_file(media):
         'file_size': media.file_size,
         'caption': file_caption
     }
-    
-    try:
-        collection.insert_one(document)
-        logger.info(f'Saved - {file_name}')
-        return 'suc'
-    except DuplicateKeyError:
-        logger.warning(f'Already Saved - {file_name}')
-        return 'dup'
-    except OperationFailure:
-        if SECOND_FILES_DATABASE_URL:
-            try:
-                second_collection.insert_one(document)
-                logger.info(f'Saved to 2nd db - {file_name}')
-                return 'suc'
-            except DuplicateKeyError:
-                logger.warning(f'Already Saved in 2nd db - {file_name}')
-                return 'dup'
+    if USE_CAPTION_FILTER:
+        document['caption_tokens'] = caption_tokens(media.caption)
+    document.update(extract_facets(file_name))
+    return document
+
+async def save_file(media):
+    """Save file in database"""
+    status, store = (await save_files([media]))[0]
+    if status == 'suc':
+        logger.info(f'Saved - {media.file_name}' if store == 0 else f'Saved to 2nd db - {media.file_name}')
+    elif status == 'dup':
+        logger.warning(f'Already Saved - {media.file_name}')
+    return status
+
+async def save_files(medias):
+    """Save many files with unordered insert_many, returns ('suc', 'dup' or 'err', store) for each media.
+
+    Stores with room are tried first, files a store refuses for any reason
+    other than a duplicate (a full quota) go to the next one in one more insert_many.
+    """
+    file_ids = unpack_new_file_ids([media.file_id for media in medias])
+    documents = [file_document(media, file_id) for media, file_id in zip(medias, file_ids)]
+    results = [None] * len(documents)
+    pending = []
+    seen = set()
+    for i, document in enumerate(documents):
+        # same file twice in one batch
+        if document['_id'] in seen:
+            results[i] = ('dup', None)
+        else:
+            seen.add(document['_id'])
+            pending.append(i)
+
+    if duplicate_filter.ready and pending:
+        # files not in the filter are surely new, only the rest are looked up
+        maybe = [documents[i]['_id'] for i in pending if documents[i]['_id'] in duplicate_filter]
+        if maybe:
+            def find(store, col):
+                return [(doc['_id'], store) for doc in col.find({'_id': {'$in': maybe}}, {'_id': 1})]
+
+            found = dict(merge_ids(await fan_out(find)))
+            for i in pending:
+                store = found.get(documents[i]['_id'])
+                if store is not None:
+                    results[i] = ('dup', store)
+            duplicate_filter.checked(len(pending) - len(maybe), len(maybe), len(found))
+            pending = [i for i in pending if results[i] is None]
         else:
-            logger.error(f'your FILES_DATABASE_URL is already full, add SECOND_FILES_DATABASE_URL')
-            return 'err'
+            duplicate_filter.checked(len(pending), 0, 0)
+
+    for store, col in file_stores.write_order():
+        if not pending:
+            break
+        try:
+            await run_sync(col.insert_many, [schema.document(documents[i]) for i in pending], ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {error['index']: error for error in e.details.get('writeErrors', [])}
+        except OperationFailure as e:
+            logger.warning(f'Files database {store} refused {len(pending)} files - {e}')
+            file_stores.mark_full(store)
+            continue
+        retry = []
+        for n, i in enumerate(pending):
+            error = failed.get(n)
+            if error is None:
+                document = documents[i]
+                results[i] = ('suc', store)
+                index_file(document['_id'], document['file_name'], document['file_size'], document['caption'], store)
+            elif error.get('code') == 11000:
+                results[i] = ('dup', store)
+            else:
+                retry.append(i)
+        if retry:
+            file_stores.mark_full(store)
+        pending = retry
+
+    if pending:
+        logger.error(f'All files databases are full, add SECOND_FILES_DATABASE_URL or EXTRA_FILES_DATABASE_URLS')
+        for i in pending:
+            results[i] = ('err', None)
+    if len(documents) > 1:
+        saved = sum(1 for status, store in results if status == 'suc')
+        logger.info(f'Saved {saved} of {len(documents)} files')
+    return results
+
+def get_query_regex(query):
+    return compile_query(query)
+
+async def get_files_by_ids(ids, fields=RESULT_FIELDS):
+    """SearchResult for (_id, store) pairs keeping the given order"""
+    files = {}
+    if replica is not None and replica.ready:
+        for doc, store in await run_sync(replica.files, [_id for _id, store in ids], fields):
+            files[doc['_id']] = SearchResult(doc, store)
+    stores = {}
+    for _id, store in ids:
+        if _id not in files:
+            stores.setdefault(store, []).append(_id)
+
+    def find(store, col):
+        return [SearchResult(doc, store) for doc in col.find({'_id': {'$in': stores[store]}}, schema.projection(fields))]
 
-async def get_search_results(query, max_results=MAX_BTN, offset=0, lang=None):
+    collections = [(store, col) for store, col in get_file_collections() if store in stores]
+    for result in await fan_out(find, collections) if collections else []:
+        for file in result:
+            files.setdefault(file._id, file)
+    return [files[_id] for _id, store in ids if _id in files]
+
+async def load_captions(files):
+    """Read captions of search results right before they are sent"""
+    missing = [(file._id, file.store) for file in files if file.caption is None]
+    if not missing:
+        return files
+    captions = {file._id: file.caption for file in await get_files_by_ids(missing, ('caption',))}
+    for file in files:
+        if file.caption is None:
+            file.caption = captions.get(file._id)
+    return files
+
+async def get_inline_results(query, max_results=MAX_BTN, offset=0):
+    """Inline search by title prefix from memory, falls back to get_search_results"""
+    if prefix_index is not None:
+        result = prefix_index.search(query, offset, max_results)
+        if result is not None and result[1]:
+            ids, total = result
+            # inline results are sent right away, they need the caption
+            files = await get_files_by_ids(ids, SEND_FIELDS)
+            next_offset = offset + max_results
+            return files, next_offset if next_offset < total else '', total
+    return await get_search_results(query, max_results, offset, fields=SEND_FIELDS)
+
+async def get_search_results(query, max_results=MAX_BTN, offset=0, lang=None, quality=None, year=None, fields=RESULT_FIELDS):
+    files, next_offset, total_results, cursor = await get_search_page(query, max_results, offset, lang=lang, quality=quality, year=year, fields=fields)
+    return files, next_offset, total_results
+
+async def get_search_page(query, max_results=MAX_BTN, offset=0, cursor=None, lang=None, quality=None, year=None, fields=RESULT_FIELDS):
+    """Same as get_search_results, also takes and returns the (store, _id) cursor of pages past the stored ids.
+
+    Cursors are kept in the search cache entry, a page the entry has a cursor
+    for needs none from the caller.
+    """
     query = str(query).strip()
-    if not query:
-        raw_pattern = '.'
-    elif ' ' not in query:
-        raw_pattern = r'(\b|[\.\+\-_])' + query + r'(\b|[\.\+\-_])'
+    key = (query.lower(), lang, quality, year)
+    cached = search_cache.get(key)
+    if cached is None:
+        start = time.perf_counter()
+        ids = None
+        if search_index is not None:
+            match = partial(match_facets, lang=lang, quality=quality, year=year) if lang or quality or year else None
+            # a common word matches most files, keep sorting them off the event loop
+            ids = await run_sync(search_index.search, query, get_query_regex(query), match, SEARCH_RANK_LIMIT, SEARCH_COUNT_LIMIT)
+            # like the mongo path, pages past the limit come from seek_page
+            complete = ids is not None and len(ids) < SEARCH_COUNT_LIMIT
+            if ids is not None:
+                planner_stats.record(QueryPlan('memory', 'index', []), time.perf_counter() - start)
+        if ids is None and replica is not None:
+            match = partial(match_facets, lang=lang, quality=quality, year=year) if lang or quality or year else None
+            ids = await run_sync(replica.search, query, get_query_regex(query), match, SEARCH_COUNT_LIMIT)
+            complete = ids is not None and len(ids) < SEARCH_COUNT_LIMIT
+            if ids is not None:
+                planner_stats.record(QueryPlan('replica', 'fts', []), time.perf_counter() - start)
+        if ids is None:
+            caption_filter = caption_token_filter(query, lang, quality, year)
+            plan, filter, sort = await plan_search(query, lang, quality, year, captions=caption_filter is None)
+            ids, names, captions = await find_ids(filter, SEARCH_COUNT_LIMIT, sort)
+            complete = len(ids) < SEARCH_COUNT_LIMIT
+            if caption_filter is not None and complete:
+                # caption matches are their own lookup in the caption token index, after the title matches
+                found, found_names, found_captions = await find_ids(caption_filter, SEARCH_COUNT_LIMIT)
+                seen = set(ids)
+                ids += [item for item in found if item not in seen]
+                complete = len(found) < SEARCH_COUNT_LIMIT and len(ids) < SEARCH_COUNT_LIMIT
+                ids = ids[:SEARCH_COUNT_LIMIT]
+                names.update(found_names)
+                captions.update(found_captions)
+            if plan.route != 'text' and plan.words and SEARCH_RANK_LIMIT:
+                # $text results are already sorted by textScore, the others are scored off the event loop
+                ids = await run_sync(rank_ids, plan.words, ids, names, captions)
+            planner_stats.record(plan, time.perf_counter() - start)
+        search_cache.put(key, query.lower().split(), ids, complete)
     else:
-        raw_pattern = query.replace(' ', r'.*[\s\.\+\-_]')
-    
-    try:
-        regex = re.compile(raw_pattern, flags=re.IGNORECASE)
-    except:
-        regex = query
+        ids, complete = cached
 
-    if USE_CAPTION_FILTER:
-        filter = {'$or': [{'file_name': regex}, {'caption': regex}]}
+    next_cursor = None
+    if complete or offset + max_results < len(ids):
+        files = await get_files_by_ids(ids[offset:][:max_results], fields)
+        has_next = offset + max_results < len(ids) or not complete
     else:
-        filter = {'file_name': regex}
-
-    cursor = collection.find(filter)
-    results = [doc for doc in cursor]
-
-    if SECOND_FILES_DATABASE_URL:
-        cursor2 = second_collection.find(filter)
-        results.extend([doc for doc in cursor2])
-
-    if lang:
-        lang_files = [file for file in results if lang in file['file_name'].lower()]
-        files = lang_files[offset:][:max_results]
-        total_results = len(lang_files)
-        next_offset = offset + max_results
-        if next_offset >= total_results:
-            next_offset = ''
-        return files, next_offset, total_results
-
-    total_results = len(results)
-    files = results[offset:][:max_results]
-    next_offset = offset + max_results
-    if next_offset >= total_results:
-        next_offset = ''   
-    return files, next_offset, total_results
+        # past the stored ids the rest of the matches follow in (store, _id) order
+        plan, filter, sort = await plan_search(query, lang, quality, year)
+        head = ids[offset:]
+        files = await get_files_by_ids(head, fields)
+        seen = [_id for _id, store in ids]
+        # one extra document tells if there is a next page
+        limit = max_results + 1 - len(head)
+        if cursor is None:
+            cursor = search_cache.cursor(key, offset)
+        if cursor is not None or offset <= len(ids):
+            tail = await seek_page(filter, cursor, limit, seen, fields)
+        else:
+            # no cursor for this page, skip to it
+            tail = await find_page(filter, offset - len(ids), limit, seen, fields)
+        has_next = len(head) + len(tail) > max_results
+        tail = tail[:max_results - len(head)]
+        if tail:
+            next_cursor = (tail[-1].store, tail[-1]._id)
+            if has_next:
+                search_cache.put_cursor(key, offset + max_results, next_cursor)
+        files.extend(tail)
+
+    total_results = len(ids) if complete else max(len(ids), offset + len(files) + has_next)
+    next_offset = offset + max_results if has_next else ''
+    return files, next_offset, total_results, next_cursor
+
+async def plan_search(query, lang=None, quality=None, year=None, captions=True):
+    """Pick how mongo should run a search, returns plan, filter and sort.
 
-async def delete_files(query):
-    query = query.strip()
-    if not query:
-        raw_pattern = '.'
-    elif ' ' not in query:
-        raw_pattern = r'(\b|[\.\+\-_])' + query + r'(\b|[\.\+\-_])'
+    With captions=False only file names are searched, the caller looks up
+    captions with caption_token_filter.
+    """
+    regex = get_query_regex(query)
+    use_caption = USE_CAPTION_FILTER and captions
+    if use_caption:
+        filters = [{'$or': [schema.match('file_name', regex), caption_token_match(query) or schema.match('caption', regex)]}]
     else:
-        raw_pattern = query.replace(' ', r'.*[\s\.\+\-_]')
-    
-    try:
-        regex = re.compile(raw_pattern, flags=re.IGNORECASE)
-    except:
-        regex = query
-        
-    filter = {'file_name': regex}
-    
-    result1 = collection.delete_many(filter)
-    
-    result2 = None
-    if SECOND_FILES_DATABASE_URL:
-        result2 = second_collection.delete_many(filter)
-    
-    total_deleted = result1.deleted_count
-    if result2:
-        total_deleted += result2.deleted_count
-    
+        filters = [schema.match('file_name', regex)]
+
+    filters.extend(facet_filters(lang, quality, year, indexed=facets_ready))
+
+    trigram_ready = trigram_index is not None and trigram_index.ready
+    plan = plan_query(query, use_caption, trigram=trigram_ready)
+    if plan.reason == 'single_word' and schema.compact and not schema.legacy and is_plain_query(plan.words):
+        # saved tokens answer a whole word search from their index
+        return QueryPlan('tokens', plan.reason, plan.words), {'t': plan.words[0], '$and': filters}, None
+    if plan.route == 'text':
+        # regex stays in the filter, text index only narrows down the documents to check
+        filter = {'$text': {'$search': plan.text_search()}, '$and': filters}
+        if await count_results(filter, limit=1):
+            return plan, filter, [('score', {'$meta': 'textScore'})]
+        planner_stats.text_misses += 1
+        can_trigram = trigram_ready and any(len(word) >= 3 for word in plan.words)
+        plan = QueryPlan('trigram' if can_trigram else 'regex', 'text_miss', plan.words)
+    if plan.route == 'trigram':
+        ids = trigram_index.candidates(plan.words)
+        if ids is not None:
+            return plan, {'_id': {'$in': ids}, '$and': filters}, None
+        plan = QueryPlan('regex', 'trigram_broad', plan.words)
+    return plan, {'$and': filters}, None
+
+def caption_token_match(query):
+    """Caption part of a search as a token lookup, None until every file has caption tokens"""
+    words = query_words(query.lower())
+    if not caption_tokens_ready or not words or not is_plain_query(words):
+        return None
+    if len(words) == 1:
+        return schema.match('caption_tokens', words[0])
+    return schema.match('caption_tokens', {'$all': [re.compile('^' + word) for word in words]})
+
+def caption_token_filter(query, lang=None, quality=None, year=None):
+    """Filter of the caption token index alone, mongo can't use it inside an $or with the file name regex"""
+    if not USE_CAPTION_FILTER:
+        return None
+    match = caption_token_match(query)
+    if match is None:
+        return None
+    return {'$and': [match] + facet_filters(lang, quality, year, indexed=facets_ready)}
+
+async def find_ids(filter, limit, sort=None):
+    """(_id, store) of the first matches in all file collections, their file names and caption tokens"""
+    names = {}
+    captions = {}
+    fields = ('file_name', 'caption_tokens') if USE_CAPTION_FILTER else ('file_name',)
+    def find(store, col):
+        cursor = col.find(filter, schema.projection(fields))
+        if sort:
+            cursor = cursor.sort(sort)
+        ids = []
+        for doc in cursor.limit(limit):
+            doc = expand_document(doc)
+            names[doc['_id']] = doc.get('file_name', '')
+            if USE_CAPTION_FILTER:
+                captions[doc['_id']] = doc.get('caption_tokens', [])
+            ids.append((doc['_id'], store))
+        return ids
+
+    return merge_ids(await fan_out(find), limit), names, captions
+
+def rank_ids(words, ids, names, captions=None):
+    """Move the best SEARCH_RANK_LIMIT matches to the front, word stats come from the matches"""
+    tokens = {_id: tokenize(name) for _id, name in names.items()}
+    n_docs = len(ids) or 1
+    avg_len = sum(len(t) for t in tokens.values()) / n_docs
+    doc_freq = {word: sum(1 for t in tokens.values() if any(word in token for token in t)) for word in words}
+    def score(item):
+        score = score_file(words, tokens[item[0]], doc_freq.get, n_docs, avg_len)
+        if captions:
+            score += score_caption(words, captions.get(item[0]))
+        return score
+    return top_k(ids, SEARCH_RANK_LIMIT, score)
+
+async def get_spell_suggestions(query, limit=5):
+    """Spelling fixes of a query from our own file names, only ones that find files"""
+    if spell_index is None:
+        return []
+    if search_index is None and (replica is None or not replica.ready):
+        # every check is a mongo search, stop at the first suggestion with files
+        limit = 1
+    suggestions = []
+    for suggestion in spell_index.suggest(query, limit * 2):
+        files, offset, total = await get_search_results(suggestion, max_results=1)
+        if files:
+            suggestions.append(suggestion)
+            if len(suggestions) == limit:
+                break
+    return suggestions
+
+async def get_facet_counts(query):
+    """Language, quality and year counts of a search's matches, for filter buttons"""
+    query = str(query).strip()
+    if search_index is not None:
+        ids = await run_sync(search_index.search, query, get_query_regex(query), None, 0, SEARCH_COUNT_LIMIT)
+        if ids is not None:
+            return count_facets(search_index.file_names(ids))
+
+    plan, filter, sort = await plan_search(query)
+    if not facets_ready:
+        ids, names, captions = await find_ids(filter, SEARCH_COUNT_LIMIT)
+        return count_facets(names.values())
+
+    languages, quality, year = (schema.names(field)[0] for field in ('languages', 'quality', 'year'))
+    def aggregate(store, col):
+        pipeline = [{'$match': filter}, {'$limit': SEARCH_COUNT_LIMIT}, {'$facet': {
+            'languages': [{'$unwind': f'${languages}'}, {'$sortByCount': f'${languages}'}],
+            'quality': [{'$unwind': f'${quality}'}, {'$sortByCount': f'${quality}'}],
+            'year': [{'$match': {year: {'$ne': None}}}, {'$sortByCount': f'${year}'}]
+        }}]
+        return list(col.aggregate(pipeline))
+
+    counts = {'languages': {}, 'quality': {}, 'year': {}}
+    for result in await fan_out(aggregate):
+        for field, values in result[0].items():
+            for value in values:
+                counts[field][value['_id']] = counts[field].get(value['_id'], 0) + value['count']
+    return counts
+
+def tail_filter(filter, seen, after=None):
+    """filter without the stored ids, and after a cursor _id when given"""
+    condition = {'$nin': seen}
+    if after is not None:
+        condition['$gt'] = after
+    return dict(filter, **{'$and': filter['$and'] + [{'_id': condition}]})
+
+async def seek_page(filter, cursor, limit, seen, fields=RESULT_FIELDS):
+    """Next SearchResult after cursor in (store, _id) order, each query seeks on the _id index"""
+    def find(col, filter, limit):
+        return list(col.find(filter, schema.projection(fields)).sort('_id', 1).limit(limit))
+
+    files = []
+    for store, col in get_file_collections():
+        if cursor is not None and store < cursor[0]:
+            continue
+        after = cursor[1] if cursor is not None and store == cursor[0] else None
+        docs = await run_sync(find, col, tail_filter(filter, seen, after), limit - len(files))
+        files.extend(SearchResult(doc, store) for doc in docs)
+        if len(files) >= limit:
+            break
+    return files
+
+async def find_page(filter, offset, limit, seen, fields=RESULT_FIELDS):
+    """Page through file collections in (store, _id) order, skip and limit run in mongo"""
+    def find(col, filter, offset, limit):
+        return list(col.find(filter, schema.projection(fields)).sort('_id', 1).skip(offset).limit(limit))
+
+    filter = tail_filter(filter, seen)
+    files = []
+    for store, col in get_file_collections():
+        # next collection skips what is left of offset, so these have to run in order
+        docs = await run_sync(find, col, filter, offset, limit - len(files))
+        files.extend(SearchResult(doc, store) for doc in docs)
+        if len(files) >= limit:
+            break
+        if docs:
+            offset = 0
+        elif offset:
+            # whole collection was skipped, carry the rest of offset to next one
+            offset -= await run_sync(col.count_documents, filter, limit=offset)
+    return files
+
+async def count_results(filter, limit=SEARCH_COUNT_LIMIT):
+    """Number of matches in all file collections, stops at limit"""
+    def count(store, col):
+        return col.count_documents(filter, limit=limit)
+
+    return min(sum(await fan_out(count)), limit)
+
+def delete_filter(query):
+    return schema.match('file_name', get_query_regex(query.strip()))
+
+async def count_delete_matches(query, preview=5):
+    """Dry run of delete_files, number of matching files and a few of their names"""
+    filter = delete_filter(query)
+
+    def count(store, col):
+        names = [expand_document(doc).get('file_name', '') for doc in col.find(filter, schema.projection(['file_name'])).limit(preview)]
+        return col.count_documents(filter), names
+
+    results = await fan_out(count, background=True)
+    names = [name for count, store_names in results for name in store_names]
+    return sum(count for count, store_names in results), names[:preview]
+
+async def delete_files(query, progress=None, cancelled=None, batch_size=500):
+    """Delete matching files one store at a time in _id ordered batches.
+
+    progress(deleted) is awaited after every batch and cancelled() is checked
+    before the next one. Every batch is a short job in the db executor, so
+    searches keep running during a large delete.
+    """
+    filter = delete_filter(query)
+
+    def delete_batch(col, last_id):
+        batch_filter = {'$and': [filter, {'_id': {'$gt': last_id}}]} if last_id is not None else filter
+        ids = [doc['_id'] for doc in col.find(batch_filter, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            return ids, 0
+        return ids, col.delete_many({'_id': {'$in': ids}}).deleted_count
+
+    total_deleted = 0
+    for store, col in get_file_collections():
+        last_id = None
+        while not (cancelled and cancelled()):
+            ids, deleted = await run_sync(delete_batch, col, last_id)
+            if not ids:
+                break
+            last_id = ids[-1]
+            unindex_files(ids)
+            total_deleted += deleted
+            if progress:
+                await progress(total_deleted)
     return total_deleted
 
 async def get_file_details(query):
-    file_details = collection.find_one({'_id': query})
-    if not file_details and SECOND_FILES_DATABASE_URL:
-        file_details = second_collection.find_one({'_id': query})
-    return file_details
-
-def encode_file_id(s: bytes) -> str:
-    r = b""
-    n = 0
-    for i in s + bytes([22]) + bytes([4]):
-        if i == 0:
-            n += 1
-        else:
-            if n:
-                r += b"\x00" + bytes([n])
-                n = 0
-            r += bytes([i])
-    return base64.urlsafe_b64encode(r).decode().rstrip("=")
-
-def unpack_new_file_id(new_file_id):
-    decoded = FileId.decode(new_file_id)
-    file_id = encode_file_id(
-        pack(
-            "<iiqq",
-            int(decoded.file_type),
-            decoded.dc_id,
-            decoded.media_id,
-            decoded.access_hash
-        )
-    )
-    return file_id
\ No newline at end of file
+    def find(store, col):
+        doc = col.find_one({'_id': query}, schema.projection(SEND_FIELDS))
+        return SearchResult(doc, store) if doc else None
+
+    store = file_stores.locate(query)
+    if store is not None:
+        # known store, one lookup instead of asking every database
+        file_details = await run_sync(find, store, file_stores.cols[store])
+        if file_details:
+            if prefix_index is not None:
+                prefix_index.hit(query)
+            return file_details
+
+    for file_details in await fan_out(find):
+        if file_details:
+            if prefix_index is not None:
+                prefix_index.hit(query)
+            return file_details
+    return None
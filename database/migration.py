@@ -0,0 +1,116 @@
+import time
+from pymongo.errors import BulkWriteError
+
+
+class StoreMigration:
+    """Copy or move files from one files database to another in _id order.
+
+    After every batch the last _id is saved in the target database, so a
+    stopped migration continues from there. Used by /migrate and migrate.py,
+    runs in a worker thread.
+    """
+
+    def __init__(self, source, target, source_store, target_store, move=True, batch_size=500, rate=0, limit=0):
+        self.source = source
+        self.target = target
+        self.move = move
+        self.batch_size = batch_size
+        self.rate = rate
+        self.limit = limit
+        self.checkpoints = target.database['migrations']
+        self.name = f'{source_store}->{target_store}'
+        self.cancelled = False
+        self.copied = 0
+        self.start_id = None
+        self.last_id = None
+
+    def load_checkpoint(self):
+        checkpoint = self.checkpoints.find_one({'_id': self.name})
+        if checkpoint and not checkpoint.get('done'):
+            self.start_id = checkpoint.get('start_id')
+            self.last_id = checkpoint.get('last_id')
+            self.copied = checkpoint.get('copied', 0)
+
+    def save_checkpoint(self, done=False):
+        self.checkpoints.update_one({'_id': self.name}, {'$set': {
+            'start_id': self.start_id,
+            'last_id': self.last_id,
+            'copied': self.copied,
+            'move': self.move,
+            'done': done
+        }}, upsert=True)
+
+    def run(self, on_batch=None):
+        """Migrate until the source is done, limit is reached or cancelled, True when the source is done"""
+        self.load_checkpoint()
+        copied_now = 0
+        finished = False
+        while not self.cancelled:
+            size = self.batch_size
+            if self.limit:
+                size = min(size, self.limit - copied_now)
+                if size <= 0:
+                    break
+            started = time.monotonic()
+            filter = {'_id': {'$gt': self.last_id}} if self.last_id is not None else {}
+            docs = list(self.source.find(filter).sort('_id', 1).limit(size))
+            if not docs:
+                finished = True
+                break
+            try:
+                self.target.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # files copied before a restart are already there
+                errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+                if errors:
+                    raise
+            ids = [doc['_id'] for doc in docs]
+            if self.move:
+                self.source.delete_many({'_id': {'$in': ids}})
+            if self.start_id is None:
+                self.start_id = ids[0]
+            self.last_id = ids[-1]
+            self.copied += len(ids)
+            copied_now += len(ids)
+            self.save_checkpoint()
+            if on_batch:
+                on_batch(ids)
+            if self.rate:
+                wait = len(ids) / self.rate - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+        if finished:
+            self.save_checkpoint(done=True)
+        return finished
+
+    def verify(self):
+        """Check the migrated _id range in both databases, returns a list of problems"""
+        if self.start_id is None:
+            return []
+        problems = []
+        id_range = {'_id': {'$gte': self.start_id, '$lte': self.last_id}}
+        if self.move:
+            left = self.source.count_documents(id_range)
+            if left:
+                problems.append(f'{left} files still in source')
+            found = self.target.count_documents(id_range)
+            if found < self.copied:
+                problems.append(f'target has {found} of {self.copied} moved files')
+            return problems
+
+        missing = 0
+        batch = []
+        for doc in self.source.find(id_range, {'_id': 1}).sort('_id', 1):
+            batch.append(doc['_id'])
+            if len(batch) == 1000:
+                missing += len(batch) - self.target.count_documents({'_id': {'$in': batch}})
+                batch = []
+        if batch:
+            missing += len(batch) - self.target.count_documents({'_id': {'$in': batch}})
+        if missing:
+            problems.append(f'{missing} files missing in target')
+        return problems
+
+    def summary(self):
+        action = 'moved' if self.move else 'copied'
+        return f'{self.copied} files {action} {self.name}'
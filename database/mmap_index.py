@@ -0,0 +1,496 @@
+import os
+import mmap
+import heapq
+import shutil
+import logging
+import tempfile
+import threading
+from array import array
+from bisect import bisect_right
+from struct import Struct
+from database.search_index import InvertedIndex, tokenize, is_plain_query
+from database.ranking import score_file, top_k
+from database.query_regex import query_words
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AFBIDX01'
+SECTIONS = ('stores', 'id_offsets', 'ids', 'name_offsets', 'names', 'id_order',
+            'term_offsets', 'terms', 'posting_offsets', 'doc_freqs', 'postings')
+# magic, files, terms, total name tokens, then where every section starts
+HEADER = Struct('<8sIIQ' + 'Q' * len(SECTIONS))
+# term length and posting count before every term of a spilled run
+RUN_ENTRY = Struct('<HI')
+
+
+def encode_deltas(nums):
+    """Sorted numbers as varint gaps"""
+    out = bytearray()
+    last = 0
+    for num in nums:
+        delta = num - last
+        last = num
+        while delta > 0x7f:
+            out.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return out
+
+
+def decode_deltas(data):
+    nums = []
+    num = delta = shift = 0
+    for byte in data:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            num += delta
+            nums.append(num)
+            delta = shift = 0
+    return nums
+
+
+def spill_run(postings):
+    """Postings of one block of files as a temp file sorted by term"""
+    run = tempfile.TemporaryFile()
+    for term in sorted(postings):
+        nums = postings[term]
+        key = term.encode()
+        run.write(RUN_ENTRY.pack(len(key), len(nums)))
+        run.write(key)
+        run.write(nums.tobytes())
+    run.seek(0)
+    return run
+
+
+def read_run(run):
+    while True:
+        header = run.read(RUN_ENTRY.size)
+        if not header:
+            return
+        size, count = RUN_ENTRY.unpack(header)
+        term = run.read(size)
+        nums = array('I')
+        nums.frombytes(run.read(4 * count))
+        yield term, nums
+
+
+def merge_runs(runs):
+    """(term, nums) over all runs in term order, runs are in file order so the lists stay sorted"""
+    term, nums = None, None
+    for next_term, next_nums in heapq.merge(*(read_run(run) for run in runs), key=lambda entry: entry[0]):
+        if next_term == term:
+            nums.extend(next_nums)
+            continue
+        if term is not None:
+            yield term, nums
+        term, nums = next_term, next_nums
+    if term is not None:
+        yield term, nums
+
+
+def write_index(path, docs, removed=(), block_size=20000):
+    """Write the index file of (_id, store, file_name) docs, returns the number of files.
+
+    Only offset tables stay in memory, ids, names and sorted posting runs of
+    every block_size files are spilled to temp files and merged at the end.
+    """
+    stores = bytearray()
+    id_offsets = array('I', [0])
+    name_offsets = array('I', [0])
+    ids = tempfile.TemporaryFile()
+    names = tempfile.TemporaryFile()
+    runs = []
+    postings = {}
+    total_tokens = 0
+    for _id, store, file_name in docs:
+        if _id in removed:
+            continue
+        num = len(stores)
+        name = str(file_name).lower()
+        id_offsets.append(id_offsets[-1] + ids.write(str(_id).encode()))
+        name_offsets.append(name_offsets[-1] + names.write(name.encode()))
+        stores.append(store)
+        tokens = tokenize(name)
+        total_tokens += len(tokens)
+        for token in set(tokens):
+            plist = postings.get(token)
+            if plist is None:
+                postings[token] = array('I', [num])
+            else:
+                plist.append(num)
+        if (num + 1) % block_size == 0:
+            runs.append(spill_run(postings))
+            postings = {}
+    if postings:
+        runs.append(spill_run(postings))
+    postings = None
+    n_docs = len(stores)
+
+    # a file saved in two stores keeps its first number, later ones are left out of the tables
+    ids.flush()
+    ids_mm = mmap.mmap(ids.fileno(), 0, access=mmap.ACCESS_READ) if id_offsets[-1] else b''
+    order = sorted(range(n_docs), key=lambda num: ids_mm[id_offsets[num]:id_offsets[num + 1]])
+    id_order = array('I')
+    dropped = set()
+    last = None
+    for num in order:
+        key = ids_mm[id_offsets[num]:id_offsets[num + 1]]
+        if key == last:
+            dropped.add(num)
+            continue
+        last = key
+        id_order.append(num)
+    order = None
+
+    terms = tempfile.TemporaryFile()
+    lists = tempfile.TemporaryFile()
+    term_offsets = array('I', [0])
+    posting_offsets = array('I', [0])
+    doc_freqs = array('I')
+    for term, nums in merge_runs(runs):
+        if dropped:
+            nums = [num for num in nums if num not in dropped]
+            if not nums:
+                continue
+        term_offsets.append(term_offsets[-1] + terms.write(term))
+        posting_offsets.append(posting_offsets[-1] + lists.write(encode_deltas(nums)))
+        doc_freqs.append(len(nums))
+    for run in runs:
+        run.close()
+
+    sections = [stores, id_offsets, ids, name_offsets, names, id_order,
+                term_offsets, terms, posting_offsets, doc_freqs, lists]
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(bytes(HEADER.size))
+        starts = []
+        for section in sections:
+            # tables are read as 4 byte numbers
+            f.write(bytes(-f.tell() % 8))
+            starts.append(f.tell())
+            if isinstance(section, (bytearray, array)):
+                f.write(section)
+            else:
+                section.seek(0)
+                shutil.copyfileobj(section, f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, n_docs, len(doc_freqs), total_tokens, *starts))
+        f.flush()
+        os.fsync(f.fileno())
+    if isinstance(ids_mm, mmap.mmap):
+        ids_mm.close()
+    for spill in (ids, names, terms, lists):
+        spill.close()
+    # readers keep the old file open until they let go of it
+    os.replace(tmp, path)
+    return n_docs - len(dropped)
+
+
+class IndexFile:
+    """Read only view of an index file, every table is a slice of the mapping"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, self.n_terms, self.total_tokens, *starts = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a search index file')
+        view = memoryview(self.mm)
+        ends = starts[1:] + [len(self.mm)]
+        sizes = {'stores': self.n_docs, 'id_offsets': 4 * (self.n_docs + 1), 'name_offsets': 4 * (self.n_docs + 1),
+                 'id_order': 4 * self.n_docs, 'term_offsets': 4 * (self.n_terms + 1),
+                 'posting_offsets': 4 * (self.n_terms + 1), 'doc_freqs': 4 * self.n_terms}
+        self.starts = dict(zip(SECTIONS, starts))
+        for name, start, end in zip(SECTIONS, starts, ends):
+            section = view[start:start + sizes[name]] if name in sizes else view[start:end]
+            setattr(self, name, section.cast('I') if name in sizes and name != 'stores' else section)
+
+    def id_key(self, num):
+        return bytes(self.ids[self.id_offsets[num]:self.id_offsets[num + 1]])
+
+    def doc_id(self, num):
+        return self.id_key(num).decode()
+
+    def name(self, num):
+        return bytes(self.names[self.name_offsets[num]:self.name_offsets[num + 1]]).decode()
+
+    def term(self, i):
+        return bytes(self.terms[self.term_offsets[i]:self.term_offsets[i + 1]])
+
+    def find_doc(self, _id):
+        """Number of a file by _id, binary search over id_order"""
+        key = str(_id).encode()
+        lo, hi = 0, self.n_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.id_key(self.id_order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_docs and self.id_key(self.id_order[lo]) == key:
+            return self.id_order[lo]
+        return None
+
+    def find_term(self, word):
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def docs(self, i):
+        return decode_deltas(self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]])
+
+    def doc_freq(self, word):
+        i = self.find_term(word.encode())
+        return self.doc_freqs[i] if i < self.n_terms and self.term(i) == word.encode() else 0
+
+    def docs_for(self, word, mode):
+        """Posting numbers for one query word, mode is exact, prefix or substring"""
+        word = word.encode()
+        docs = set()
+        if mode == 'substring':
+            # search the joined terms, a match must not cross into the next term
+            start = self.starts['terms']
+            end = start + self.term_offsets[self.n_terms]
+            pos = self.mm.find(word, start, end)
+            while pos != -1:
+                i = bisect_right(self.term_offsets, pos - start) - 1
+                term_end = start + self.term_offsets[i + 1]
+                if pos + len(word) <= term_end:
+                    docs.update(self.docs(i))
+                    pos = self.mm.find(word, term_end, end)
+                else:
+                    pos = self.mm.find(word, pos + 1, end)
+            return docs
+        i = self.find_term(word)
+        while i < self.n_terms and self.term(i).startswith(word):
+            if mode == 'exact' and self.term(i) != word:
+                break
+            docs.update(self.docs(i))
+            i += 1
+        return docs
+
+
+class MmapIndex:
+    """File name search index in a memory mapped file, for hosts with little memory.
+
+    The file has the files, a sorted term dictionary, varint delta posting
+    lists and offset tables, all read as slices of the mapping so the page
+    cache holds it instead of the heap. Files saved or deleted after the file
+    was written go to a small in-memory overlay and a removed set. A rebuild
+    writes a new file from mongo in a worker thread and swaps it in, then the
+    overlay starts over. At startup the saved file is kept when every store
+    still has the same number of files. Searches give the same results as
+    InvertedIndex.
+    """
+
+    def __init__(self, path, use_caption=False, rebuild_after=5000):
+        self.path = path
+        self.use_caption = use_caption
+        self.rebuild_after = rebuild_after
+        self.lock = threading.Lock()
+        self.ready = False
+        self.file = None
+        self.overlay = self.new_overlay()
+        self.removed = set()
+        self.moved = {}
+        # changes while a rebuild runs, they are kept after the swap
+        self.pending = None
+        if use_caption:
+            logger.warning('mmap search index has file names only, searches with USE_CAPTION_FILTER use mongo')
+        # a file from the last run is used until enough files change
+        self.saved = False
+        if os.path.exists(path):
+            try:
+                self.file = IndexFile(path)
+                self.ready = True
+                self.saved = True
+            except (OSError, ValueError) as e:
+                logger.warning(f'Search index file not loaded, building a new one - {e}')
+
+    @staticmethod
+    def new_overlay():
+        overlay = InvertedIndex()
+        overlay.ready = True
+        return overlay
+
+    def __len__(self):
+        base = self.file.n_docs if self.file else 0
+        return base + len(self.overlay) - len(self.removed)
+
+    def needs_rebuild(self):
+        return len(self.overlay) + len(self.removed) + len(self.moved) >= self.rebuild_after
+
+    def changes(self):
+        return [(self.overlay, self.removed, self.moved)] + ([self.pending] if self.pending else [])
+
+    def add(self, _id, file_name, caption=None, store=0):
+        with self.lock:
+            for overlay, removed, moved in self.changes():
+                removed.discard(_id)
+                overlay.add(_id, file_name, None, store)
+            return True
+
+    def remove(self, ids):
+        with self.lock:
+            for overlay, removed, moved in self.changes():
+                overlay.remove(ids)
+                removed.update(ids)
+            return len(ids)
+
+    def move(self, ids, store):
+        with self.lock:
+            for overlay, removed, moved in self.changes():
+                overlay.move(ids, store)
+                moved.update((_id, store) for _id in ids)
+
+    def up_to_date(self, sources):
+        """Saved file has as many files in every store as mongo"""
+        counts = bytes(self.file.stores)
+        return all(counts.count(store) == col.estimated_document_count() for store, col in sources)
+
+    def build(self, sources):
+        """Write a new index file from (store, collection) pairs and swap it in, runs in a worker thread"""
+        saved, self.saved = self.saved, False
+        if saved and self.up_to_date(sources):
+            logger.info(f'Search index file loaded - {len(self)} files')
+            return
+        with self.lock:
+            self.pending = (self.new_overlay(), set(), {})
+        try:
+            docs = ((doc['_id'], store, doc.get('file_name', '')) for store, col in sources for doc in col.find({}, {'file_name': 1}))
+            count = write_index(self.path, docs, self.pending[1])
+            new_file = IndexFile(self.path)
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+        with self.lock:
+            # old mapping is closed when the last search using it is done
+            self.file = new_file
+            self.overlay, self.removed, self.moved = self.pending
+            self.pending = None
+            self.ready = True
+        logger.info(f'Search index file written - {count} files, {os.path.getsize(self.path) // 1024} KB')
+
+    def store(self, num, _id):
+        return self.moved.get(_id, self.file.stores[num])
+
+    def file_names(self, ids):
+        names = []
+        for _id, store in ids:
+            if _id in self.overlay.doc_nums:
+                names.append(self.overlay.names[self.overlay.doc_nums[_id]])
+                continue
+            num = self.file.find_doc(_id) if self.file else None
+            if num is not None:
+                names.append(self.file.name(num))
+        return names
+
+    def search(self, query, regex, match=None, rank_limit=0, limit=0):
+        """Ordered list of matching (_id, store), or None when the query needs the regex path"""
+        if not self.ready or self.use_caption:
+            return None
+        words = query_words(query.lower()) if query else []
+        if not words or not is_plain_query(words):
+            return None
+
+        with self.lock:
+            file, overlay, removed = self.file, self.overlay, set(self.removed)
+        if len(words) == 1:
+            nums = file.docs_for(words[0], 'exact')
+        else:
+            # first word can sit anywhere inside a token, the rest follow a separator
+            groups = [file.docs_for(words[0], 'substring')]
+            groups.extend(file.docs_for(word, 'prefix') for word in words[1:])
+            groups.sort(key=len)
+            nums = groups[0]
+            for group in groups[1:]:
+                if not nums:
+                    break
+                nums &= group
+
+        items = []
+        seen = set()
+        for num in nums:
+            _id = file.doc_id(num)
+            if _id in removed or _id in overlay.doc_nums:
+                continue
+            name = file.name(num)
+            if len(words) > 1 and not regex.search(name):
+                continue
+            seen.add(_id)
+            items.append((self.store(num, _id), num, _id, name))
+        for _id, store in overlay.search(query, regex) or []:
+            if _id not in seen:
+                items.append((store, file.n_docs + overlay.doc_nums[_id], _id, overlay.names[overlay.doc_nums[_id]]))
+
+        if match:
+            items = [item for item in items if match(item[3])]
+        items.sort()
+        if limit:
+            items = items[:limit]
+        if rank_limit:
+            n_docs = len(self) or 1
+            avg_len = (file.total_tokens + overlay.total_tokens) / n_docs
+            def doc_freq(word):
+                return file.doc_freq(word) + len(overlay.postings.get(word, ())) or len(items)
+            items = top_k(items, rank_limit, lambda item: score_file(words, tokenize(item[3]), doc_freq, n_docs, avg_len))
+        return [(_id, store) for store, num, _id, name in items]
+
+
+if __name__ == "__main__":
+    # python -m database.mmap_index, compares results and memory with InvertedIndex
+    import random
+    import tracemalloc
+    from database.query_regex import compile_query
+
+    random.seed(1)
+    vocab = [''.join(random.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(random.randint(3, 9))) for _ in range(20000)]
+    docs = [(f'id{i}', i % 2, ' '.join(random.choice(vocab) for _ in range(random.randint(2, 6))) + f' {random.randint(1990, 2024)} 720p')
+            for i in range(100000)]
+
+    class Col:
+        def __init__(self, store):
+            self.store = store
+
+        def find(self, filter=None, projection=None):
+            return ({'_id': _id, 'file_name': name} for _id, store, name in docs if store == self.store)
+
+    sources = [(0, Col(0)), (1, Col(1))]
+    tracemalloc.start()
+    heap = InvertedIndex()
+    heap.build(sources)
+    heap_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    path = '/tmp/search_index_bench.bin'
+    index = MmapIndex(path)
+    tracemalloc.start()
+    index.build(sources)
+    build_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    tracemalloc.start()
+    index = MmapIndex(path)
+    mmap_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'heap index {heap_size // 1024} KB, mmap index {mmap_size // 1024} KB heap + {os.path.getsize(path) // 1024} KB file, '
+          f'{build_peak // 1024} KB peak while writing it')
+
+    index.add('new1', f'{vocab[0]} {vocab[1]} 2020', store=1)
+    heap.add('new1', f'{vocab[0]} {vocab[1]} 2020', store=1)
+    index.remove(['id5', 'id7'])
+    heap.remove(['id5', 'id7'])
+    for query in [vocab[0], vocab[1][:3], f'{vocab[0][1:]} {vocab[1][:2]}', f'{vocab[2]} 2019', 'zzz', f'{vocab[3]} 720p']:
+        regex = compile_query(query)
+        expected = heap.search(query, regex, rank_limit=100)
+        got = index.search(query, regex, rank_limit=100)
+        assert expected == got, query
+    print('same results as InvertedIndex')
+    os.remove(path)
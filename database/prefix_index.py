@@ -0,0 +1,98 @@
+import heapq
+import logging
+import threading
+from bisect import bisect_left, insort
+from database.search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixIndex:
+    """Sorted file titles for inline search while the user is still typing.
+
+    Titles are file name tokens joined by single spaces, a binary search finds
+    the first title starting with the query and the matches follow it. Matches
+    are ordered by how many times each file was sent.
+    """
+
+    def __init__(self, max_matches=1000):
+        self.max_matches = max_matches
+        self.ready = False
+        self.lock = threading.Lock()
+        self.titles = []
+        self.ids = []
+        self.doc_nums = {}
+        self.removed = set()
+        self.popularity = {}
+
+    def __len__(self):
+        return len(self.doc_nums)
+
+    def add(self, _id, file_name, store=0):
+        with self.lock:
+            if _id in self.doc_nums:
+                return False
+            self.removed.discard(_id)
+            num = len(self.ids)
+            self.ids.append((_id, store))
+            self.doc_nums[_id] = num
+            title = ' '.join(tokenize(file_name))
+            if self.ready:
+                insort(self.titles, (title, num))
+            else:
+                # sorted once when the build is done
+                self.titles.append((title, num))
+            return True
+
+    def remove(self, ids):
+        with self.lock:
+            for _id in ids:
+                num = self.doc_nums.pop(_id, None)
+                if num is None:
+                    if not self.ready:
+                        self.removed.add(_id)
+                    continue
+                self.ids[num] = None
+                self.popularity.pop(num, None)
+
+    def move(self, ids, store):
+        with self.lock:
+            for _id in ids:
+                num = self.doc_nums.get(_id)
+                if num is not None:
+                    self.ids[num] = (_id, store)
+
+    def hit(self, _id):
+        num = self.doc_nums.get(_id)
+        if num is not None:
+            self.popularity[num] = self.popularity.get(num, 0) + 1
+
+    def build(self, sources):
+        for store, col in sources:
+            for doc in col.find({}, {'file_name': 1}):
+                if doc['_id'] in self.removed:
+                    continue
+                self.add(doc['_id'], doc.get('file_name', ''), store)
+        with self.lock:
+            self.titles.sort()
+            self.removed.clear()
+            self.ready = True
+        logger.info(f'Prefix index loaded - {len(self)} files')
+
+    def search(self, query, offset=0, limit=10):
+        """One page of (_id, store) whose title starts with the query and the match count, None when not usable"""
+        prefix = ' '.join(tokenize(query))
+        if not self.ready or not prefix:
+            return None
+        titles = self.titles
+        matches = []
+        i = bisect_left(titles, (prefix,))
+        while i < len(titles) and len(matches) < self.max_matches:
+            title, num = titles[i]
+            if not title.startswith(prefix):
+                break
+            if self.ids[num] is not None:
+                matches.append(num)
+            i += 1
+        best = heapq.nlargest(offset + limit, matches, key=lambda num: self.popularity.get(num, 0))
+        return [self.ids[num] for num in best[offset:offset + limit]], len(matches)
@@ -0,0 +1,76 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'[^\W_]+')
+# mongo leaves these out of english $text searches
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'that', 'the', 'to', 'was', 'were', 'will', 'with', 'i', 'me', 'my',
+    'we', 'our', 'you', 'your', 'they', 'them', 'this', 'these', 'those', 'not', 'no', 'so', 'do'
+}
+
+
+class QueryPlan:
+    def __init__(self, route, reason, words):
+        self.route = route
+        self.reason = reason
+        self.words = words
+
+    def text_search(self):
+        # every word as a phrase, so all of them are required like in the regex
+        return ' '.join(f'"{word}"' for word in self.words)
+
+
+def plan_query(query, use_caption=False, trigram=False):
+    """Pick $text, trigram or regex for a search query.
+
+    Single word regex searches already match whole words only, so they can use
+    the text index. In multi word searches the regex finds later words as the
+    start of any token, which $text misses ("home" in "homecoming"), so they go
+    to the trigram index when it is loaded and to the regex otherwise.
+    """
+    words = query.lower().split(' ') if query else []
+    if not words:
+        return QueryPlan('regex', 'empty', words)
+    if not all(word and WORD_RE.fullmatch(word) for word in words):
+        return QueryPlan('regex', 'symbols', words)
+    can_trigram = trigram and any(len(word) >= 3 for word in words)
+    if use_caption:
+        return QueryPlan('trigram' if can_trigram else 'regex', 'caption', words)
+    if all(word in STOP_WORDS for word in words):
+        return QueryPlan('trigram' if can_trigram else 'regex', 'stop_words', words)
+    if len(words) == 1:
+        return QueryPlan('text', 'single_word', words)
+    return QueryPlan('trigram' if can_trigram else 'regex', 'multi_word', words)
+
+
+class PlannerStats:
+    """Route counts and timings to see how often the $text fast path is used"""
+
+    def __init__(self):
+        self.routes = {}
+        self.text_misses = 0
+
+    def record(self, plan, seconds):
+        count, total = self.routes.get(plan.route, (0, 0.0))
+        self.routes[plan.route] = (count + 1, total + seconds)
+        logger.debug(f'Search plan {plan.route} ({plan.reason}) took {seconds * 1000:.1f} ms')
+
+    def hit_rate(self):
+        searches = sum(count for count, total in self.routes.values())
+        if not searches:
+            return 0.0
+        return self.routes.get('text', (0, 0.0))[0] / searches * 100
+
+    def summary(self):
+        text = f'text hit rate {self.hit_rate():.1f}%'
+        for route, (count, total) in sorted(self.routes.items()):
+            text += f', {route} {count} avg {total / count * 1000:.1f} ms'
+        if self.text_misses:
+            text += f', text misses {self.text_misses}'
+        return text
+
+
+planner_stats = PlannerStats()
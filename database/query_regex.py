@@ -0,0 +1,75 @@
+import re
+
+MAX_QUERY_LENGTH = 100
+MAX_QUERY_WORDS = 8
+SEPARATOR = r'[\s\.\+\-_]'
+
+
+def query_words(query):
+    """Words of a search query, cut to MAX_QUERY_LENGTH and MAX_QUERY_WORDS"""
+    return str(query)[:MAX_QUERY_LENGTH].split()[:MAX_QUERY_WORDS]
+
+
+def compile_query(query):
+    """Search regex for user text with bounded matching time.
+
+    Words are escaped, so the only repetition left is one .*? before every
+    word after the first. Each of those sits in an atomic group and stops at
+    the first place the next word fits, which is also where the old greedy
+    pattern could find it, so a miss never backtracks into the earlier words.
+    Mongo runs the same pattern, PCRE has atomic groups too.
+    """
+    words = [re.escape(word) for word in query_words(query)]
+    if not words:
+        raw_pattern = '.'
+    elif len(words) == 1:
+        raw_pattern = r'(\b|[\.\+\-_])' + words[0] + r'(\b|[\.\+\-_])'
+    else:
+        raw_pattern = words[0] + ''.join(f'(?>.*?{SEPARATOR}{word})' for word in words[1:])
+    return re.compile(raw_pattern, flags=re.IGNORECASE)
+
+
+if __name__ == "__main__":
+    # python -m database.query_regex, worst match time of random and crafted queries
+    import random
+    import time
+
+    def old_query_regex(query):
+        if ' ' not in query:
+            raw_pattern = r'(\b|[\.\+\-_])' + query + r'(\b|[\.\+\-_])'
+        else:
+            raw_pattern = query.replace(' ', r'.*[\s\.\+\-_]')
+        try:
+            return re.compile(raw_pattern, flags=re.IGNORECASE)
+        except re.error:
+            return None
+
+    def worst_time(regex, names):
+        worst = 0
+        for name in names:
+            start = time.perf_counter()
+            regex.search(name)
+            worst = max(worst, time.perf_counter() - start)
+        return worst
+
+    random.seed(1)
+    alphabet = 'aa  .-_+*?()[]{}|\\^$'
+    names = ['a ' * 127, 'a' * 255, 'a.' * 127 + '!', ' '.join(['the'] * 60)]
+    names += [''.join(random.choice('ab .-_') for _ in range(255)) for _ in range(50)]
+    queries = ['a ' * 50 + 'b', '(a+)+$', '(a|a)*b', '.*' * 30, 'the ' * 20 + 'end', 'x' * 500]
+    queries += [''.join(random.choice(alphabet) for _ in range(random.randint(1, 150))) for _ in range(2000)]
+
+    worst, worst_query = 0, None
+    for query in queries:
+        regex = compile_query(query)
+        spent = worst_time(regex, names)
+        if spent > worst:
+            worst, worst_query = spent, query
+    print(f'{len(queries)} queries x {len(names)} names, worst match {worst * 1000:.2f} ms for {worst_query[:40]!r}')
+
+    # the old pattern on a small crafted input, every extra word multiplies the time
+    for words in (3, 4, 5):
+        regex = old_query_regex('a ' * words + 'b')
+        new = compile_query('a ' * words + 'b')
+        name = 'a ' * 60
+        print(f'{words} words + miss, old {worst_time(regex, [name]) * 1000:.1f} ms, new {worst_time(new, [name]) * 1000:.3f} ms')
@@ -0,0 +1,79 @@
+import re
+import math
+import heapq
+from info import QUALITY
+
+K1 = 1.2
+B = 0.75
+EXACT_TITLE_BOOST = 3.0
+YEAR_BOOST = 1.5
+PROXIMITY_BOOST = 1.0
+# a query word in the caption counts this much, a title match scores a lot more
+CAPTION_WEIGHT = 0.5
+
+YEAR_RE = re.compile(r'(19|20)\d{2}')
+# first of these in a file name ends the title part
+TAG_RE = re.compile(r'(19|20)\d{2}|\d{3,4}p|s\d{1,2}(e\d{1,3})?|e\d{1,3}')
+
+
+def title_tokens(tokens):
+    for i, token in enumerate(tokens):
+        if token in QUALITY or TAG_RE.fullmatch(token):
+            return tokens[:i]
+    return tokens
+
+
+def score_file(words, tokens, doc_freq, n_docs, avg_len):
+    """BM25 over file name tokens plus boosts for exact title, year and words close together"""
+    if not tokens:
+        return 0.0
+    score = 0.0
+    positions = []
+    norm = K1 * (1 - B + B * len(tokens) / (avg_len or 1))
+    for word in words:
+        # full token counts once, a word typed half counts as half
+        tf = 0.0
+        first = None
+        for pos, token in enumerate(tokens):
+            if word in token:
+                tf += 1.0 if token == word else 0.5
+                if first is None:
+                    first = pos
+        if not tf:
+            continue
+        positions.append(first)
+        df = doc_freq(word)
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        score += idf * tf * (K1 + 1) / (tf + norm)
+
+    title_words = [word for word in words if not YEAR_RE.fullmatch(word)]
+    if title_words and title_tokens(tokens) == title_words:
+        score += EXACT_TITLE_BOOST
+    if any(YEAR_RE.fullmatch(word) and word in tokens for word in words):
+        score += YEAR_BOOST
+    if len(words) > 1 and len(positions) == len(words):
+        span = max(positions) - min(positions) + 1
+        score += PROXIMITY_BOOST * len(words) / max(span, len(words))
+    return score
+
+
+def score_caption(words, tokens):
+    """Caption matches weighted apart from the title, full token 1, prefix half, times CAPTION_WEIGHT"""
+    if not tokens or not words:
+        return 0.0
+    score = 0.0
+    for word in words:
+        if word in tokens:
+            score += 1.0
+        elif any(token.startswith(word) for token in tokens):
+            score += 0.5
+    return CAPTION_WEIGHT * score / len(words)
+
+
+def top_k(items, k, score):
+    """Best k items by score first (heap, O(n log k)), the rest keep their order after them"""
+    if k <= 0 or len(items) < 2:
+        return items
+    best = heapq.nlargest(k, items, key=score)
+    chosen = set(best)
+    return best + [item for item in items if item not in chosen]
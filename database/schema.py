@@ -0,0 +1,143 @@
+import re
+from info import COMPACT_SCHEMA
+from database.search_index import tokenize
+from utils import remove_urls
+
+SCHEMA_VERSION = 1
+CAPTION_LENGTH = 300
+CAPTION_TOKENS = 64
+HANDLE_RE = re.compile(r'@\w+')
+SHORT_FIELDS = {
+    'file_name': 'n',
+    'file_size': 's',
+    'caption': 'c',
+    'languages': 'l',
+    'quality': 'q',
+    'year': 'y',
+    'season': 'se',
+    'episode': 'ep',
+    'tokens': 't',
+    'caption_tokens': 'ct'
+}
+LONG_FIELDS = {short: field for field, short in SHORT_FIELDS.items()}
+
+
+def caption_tokens(caption):
+    """Search tokens of a caption without links and @handles, caption searches look them up"""
+    if not caption or caption == 'None':
+        return []
+    caption = HANDLE_RE.sub(' ', remove_urls(str(caption)))
+    return list(dict.fromkeys(tokenize(caption)))[:CAPTION_TOKENS]
+
+
+def compact_document(document):
+    """Short field names, clean short caption and search tokens, empty fields are left out"""
+    doc = {'_id': document['_id'], 'v': SCHEMA_VERSION}
+    for field, value in document.items():
+        if field in SHORT_FIELDS and value not in (None, [], ''):
+            doc[SHORT_FIELDS[field]] = value
+    caption = document.get('caption')
+    caption = remove_urls(caption) if caption and caption != 'None' else ''
+    caption = re.sub(r'\s+', ' ', caption).strip()[:CAPTION_LENGTH]
+    if caption:
+        doc['c'] = caption
+    else:
+        doc.pop('c', None)
+    # caption tokens are kept as given, only caption search saves them
+    doc['t'] = list(dict.fromkeys(tokenize(document.get('file_name', ''))))
+    return doc
+
+
+def expand_document(doc):
+    """Read adapter, compact documents come back with the long field names"""
+    if not doc or 'v' not in doc:
+        return doc
+    return {LONG_FIELDS.get(field, field): value for field, value in doc.items() if field != 'v'}
+
+
+class Schema:
+    """Which field names file queries use.
+
+    Without COMPACT_SCHEMA everything keeps the long names. With it new files are
+    saved compact and, until every old document is rewritten, queries ask for
+    both names.
+    """
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.legacy = True
+        self.compacted = 0
+        self.bytes_saved = 0
+
+    def names(self, field):
+        if not self.compact:
+            return [field]
+        short = SHORT_FIELDS.get(field, field)
+        return [short, field] if self.legacy else [short]
+
+    def match(self, field, condition):
+        names = self.names(field)
+        if len(names) == 1:
+            return {names[0]: condition}
+        return {'$or': [{name: condition} for name in names]}
+
+    def projection(self, fields):
+        projection = {name: 1 for field in fields for name in self.names(field)}
+        if self.compact:
+            # expand_document knows a compact document by its version
+            projection['v'] = 1
+        return projection
+
+    def text_index(self):
+        return [(name, 'text') for name in (['file_name', 'n'] if self.compact else ['file_name'])]
+
+    def document(self, document):
+        return compact_document(document) if self.compact else document
+
+    def summary(self):
+        if not self.compact:
+            return 'schema long'
+        state = 'migrating' if self.legacy else 'compact'
+        return f'schema {state} {self.compacted} rewritten {self.bytes_saved // 1024} KB saved'
+
+
+class FileCollection:
+    """Read adapter for the index builders, find() takes and gives back long field names"""
+
+    def __init__(self, col):
+        self.col = col
+
+    def find(self, filter=None, projection=None):
+        if projection:
+            fields = [field for field in projection if field != '_id']
+            projection = schema.projection(fields) if fields else {'_id': 1}
+        return map(expand_document, self.col.find(filter or {}, projection))
+
+    def __getattr__(self, name):
+        return getattr(self.col, name)
+
+
+schema = Schema(compact=COMPACT_SCHEMA)
+
+
+
+if __name__ == "__main__":
+    # python -m database.schema, a compact document read through a projection keeps its long names
+    class Col:
+        def __init__(self, doc):
+            self.doc = doc
+
+        def find(self, filter=None, projection=None):
+            return [{field: value for field, value in self.doc.items() if field == '_id' or field in projection}]
+
+    expected = {'file_name': 'Avengers 2019', 'file_size': 7, 'caption': 'hi'}
+    col = Col(compact_document(dict(expected, _id='x')))
+    schema.compact = True
+    for legacy in (True, False):
+        schema.legacy = legacy
+        for fields in (('file_name', 'file_size'), ('file_name', 'file_size', 'caption'), ('caption',)):
+            doc = expand_document(col.find({}, schema.projection(fields))[0])
+            assert {field: doc.get(field) for field in fields} == {field: expected[field] for field in fields}, doc
+        doc = next(FileCollection(col).find({}, {'file_name': 1}))
+        assert doc['file_name'] == expected['file_name'], doc
+    print('compact documents keep their fields through projections')
@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict
+
+
+class SearchCache:
+    """Search results cache with a time limit and least recently used eviction.
+
+    Only the ordered (_id, store) list of a search is kept, documents for a
+    page are always read from the database. Pages past that list continue
+    from a (store, _id) cursor, those are kept in the same entry and expire
+    with it.
+    """
+
+    def __init__(self, max_entries=500, ttl=300, max_ids=1000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_ids = max_ids
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expire, words, ids, complete, cursors = entry
+        if expire < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return ids, complete
+
+    def put(self, key, words, ids, complete):
+        if not self.max_entries or len(ids) > self.max_ids:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, words, ids, complete, {})
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def cursor(self, key, offset):
+        """Cursor the page at offset continues from, None when that page wasn't reached yet"""
+        entry = self.entries.get(key)
+        return entry[4].get(offset) if entry is not None else None
+
+    def put_cursor(self, key, offset, cursor):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[4][offset] = cursor
+
+    def invalidate_text(self, text):
+        """Drop searches a new file could show up in, every query word must be in its text"""
+        text = str(text).lower()
+        stale = [key for key, (expire, words, ids, complete, cursors) in self.entries.items()
+                 if all(word in text for word in words)]
+        for key in stale:
+            del self.entries[key]
+
+    def invalidate_ids(self, removed):
+        removed = set(removed)
+        if not removed:
+            return
+        stale = [key for key, (expire, words, ids, complete, cursors) in self.entries.items()
+                 if any(_id in removed for _id, store in ids)]
+        for key in stale:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+    def summary(self):
+        return f'cache {len(self.entries)}/{self.max_entries} hits {self.hits} misses {self.misses} evictions {self.evictions}'
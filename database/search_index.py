@@ -0,0 +1,196 @@
+import re
+import logging
+import threading
+from array import array
+from bisect import bisect_left, insort
+from database.ranking import score_file, score_caption, top_k
+from database.query_regex import query_words
+
+logger = logging.getLogger(__name__)
+
+# same word split as the regex \b boundaries used by get_search_results,
+# "_" is a separator there too so it is not part of a token
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def is_plain_query(words):
+    """Only plain word queries can be answered from tokens, everything else goes to regex"""
+    return all(word and TOKEN_RE.fullmatch(word) for word in words)
+
+
+class InvertedIndex:
+    """In-memory token index of file names (and captions) from all file collections.
+
+    Each document gets an increasing number, posting lists keep those numbers
+    in insertion order so results come back in the same order mongo returns them.
+    """
+
+    def __init__(self, use_caption=False):
+        self.use_caption = use_caption
+        self.ready = False
+        self.lock = threading.Lock()
+        self.ids = []
+        self.names = []
+        self.captions = []
+        self.stores = bytearray()
+        self.doc_nums = {}
+        self.removed = set()
+        self.postings = {}
+        self.caption_postings = {}
+        self.vocab = []
+        self.caption_vocab = []
+        self.total_tokens = 0
+
+    def __len__(self):
+        return len(self.doc_nums)
+
+    def add(self, _id, file_name, caption=None, store=0):
+        with self.lock:
+            if _id in self.doc_nums:
+                return False
+            self.removed.discard(_id)
+            num = len(self.ids)
+            name = str(file_name).lower()
+            self.ids.append(_id)
+            self.names.append(name)
+            self.stores.append(store)
+            self.doc_nums[_id] = num
+            tokens = tokenize(name)
+            self.total_tokens += len(tokens)
+            self._post(self.postings, self.vocab, tokens, num)
+            if self.use_caption:
+                caption = str(caption).lower() if caption else ''
+                self.captions.append(caption)
+                self._post(self.caption_postings, self.caption_vocab, tokenize(caption), num)
+            return True
+
+    def _post(self, postings, vocab, tokens, num):
+        for token in set(tokens):
+            plist = postings.get(token)
+            if plist is None:
+                postings[token] = array('I', [num])
+                insort(vocab, token)
+            else:
+                plist.append(num)
+
+    def remove(self, ids):
+        with self.lock:
+            removed = 0
+            for _id in ids:
+                num = self.doc_nums.pop(_id, None)
+                if num is None:
+                    # deleted while the index is still loading, skip it in build
+                    if not self.ready:
+                        self.removed.add(_id)
+                    continue
+                self.ids[num] = None
+                self.total_tokens -= len(tokenize(self.names[num]))
+                self.names[num] = ''
+                if self.use_caption:
+                    self.captions[num] = ''
+                removed += 1
+            return removed
+
+    def move(self, ids, store):
+        with self.lock:
+            for _id in ids:
+                num = self.doc_nums.get(_id)
+                if num is not None:
+                    self.stores[num] = store
+
+    def build(self, sources):
+        """Load every document from (store, collection) pairs, runs in a worker thread"""
+        projection = {'file_name': 1, 'caption': 1} if self.use_caption else {'file_name': 1}
+        for store, col in sources:
+            for doc in col.find({}, projection):
+                if doc['_id'] in self.removed:
+                    continue
+                self.add(doc['_id'], doc.get('file_name', ''), doc.get('caption'), store)
+        self.removed.clear()
+        self.ready = True
+        logger.info(f'Search index loaded - {len(self)} files')
+
+    def _docs_for(self, word, mode, postings, vocab):
+        """Posting numbers for one query word, mode is exact, prefix or substring"""
+        if mode == 'exact':
+            return set(postings.get(word, ()))
+        docs = set()
+        if mode == 'prefix':
+            i = bisect_left(vocab, word)
+            while i < len(vocab) and vocab[i].startswith(word):
+                docs.update(postings[vocab[i]])
+                i += 1
+        else:
+            for token in vocab:
+                if word in token:
+                    docs.update(postings[token])
+        return docs
+
+    def _candidates(self, words, postings, vocab):
+        if len(words) == 1:
+            return self._docs_for(words[0], 'exact', postings, vocab)
+        # first word can sit anywhere inside a token, the rest follow a separator
+        groups = [self._docs_for(words[0], 'substring', postings, vocab)]
+        groups.extend(self._docs_for(word, 'prefix', postings, vocab) for word in words[1:])
+        groups.sort(key=len)
+        docs = groups[0]
+        for group in groups[1:]:
+            if not docs:
+                break
+            docs &= group
+        return docs
+
+    def rank(self, words, nums, k):
+        n_docs = len(self.doc_nums) or 1
+        avg_len = self.total_tokens / n_docs
+        def doc_freq(word):
+            return len(self.postings.get(word, ())) or len(nums)
+        def score(num):
+            score = score_file(words, tokenize(self.names[num]), doc_freq, n_docs, avg_len)
+            if self.use_caption:
+                score += score_caption(words, tokenize(self.captions[num]))
+            return score
+        return top_k(nums, k, score)
+
+    def file_names(self, ids):
+        return [self.names[self.doc_nums[_id]] for _id, store in ids if _id in self.doc_nums]
+
+    def search(self, query, regex, match=None, rank_limit=0, limit=0):
+        """Ordered list of matching (_id, store), or None when the query needs the regex path.
+
+        With a limit only the first limit matches are kept and ranked, like the
+        first SEARCH_COUNT_LIMIT files mongo returns.
+        """
+        if not self.ready:
+            return None
+        words = query_words(query.lower()) if query else []
+        if not is_plain_query(words):
+            return None
+
+        if not words:
+            nums = [num for num, _id in enumerate(self.ids) if _id is not None]
+        else:
+            nums = self._candidates(words, self.postings, self.vocab)
+            if len(words) > 1:
+                nums = {num for num in nums if regex.search(self.names[num])}
+            if self.use_caption:
+                caption_nums = self._candidates(words, self.caption_postings, self.caption_vocab)
+                if len(words) > 1:
+                    caption_nums = {num for num in caption_nums if regex.search(self.captions[num])}
+                nums |= caption_nums
+            nums = [num for num in nums if self.ids[num] is not None]
+
+        if match:
+            nums = [num for num in nums if match(self.names[num])]
+        nums.sort(key=lambda num: (self.stores[num], num))
+        if limit:
+            nums = nums[:limit]
+        if words and rank_limit:
+            nums = self.rank(words, nums, rank_limit)
+        return [(self.ids[num], self.stores[num]) for num in nums]
@@ -0,0 +1,131 @@
+import os
+import zlib
+import time
+from struct import Struct
+from concurrent.futures import ThreadPoolExecutor
+from bson import decode_all
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import BulkWriteError
+
+MAGIC = b'AFBSNAP1'
+# store, files, raw size, compressed size, crc32 of the compressed bytes
+CHUNK = Struct('<HIIII')
+END_STORE = 0xFFFF
+RAW_DOCUMENTS = CodecOptions(document_class=RawBSONDocument)
+
+
+def count_documents(raw):
+    """Number of BSON documents in a raw batch, every document starts with its length"""
+    n = pos = 0
+    while pos < len(raw):
+        pos += int.from_bytes(raw[pos:pos + 4], 'little')
+        n += 1
+    return n
+
+
+class Snapshot:
+    """Files collections in one compressed, chunked, checksummed file.
+
+    The file is MAGIC, then chunks of up to chunk_size raw BSON documents
+    compressed with zlib, then an end chunk with the total file count. Every
+    chunk has its own crc32, a damaged chunk is reported and skipped on
+    import. Documents are copied as stored, so both schemas work. Used by
+    /snapshot and snapshot.py, runs in a worker thread.
+    """
+
+    def __init__(self, path, chunk_size=1000, workers=4):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.cancelled = False
+        self.action = None
+        self.files = 0
+        self.chunks = 0
+        self.size = 0
+        self.started = time.monotonic()
+
+    def write_chunk(self, f, store, raw):
+        data = zlib.compress(raw)
+        f.write(CHUNK.pack(store, count_documents(raw), len(raw), len(data), zlib.crc32(data)))
+        f.write(data)
+        self.size += CHUNK.size + len(data)
+
+    def export_files(self, cols):
+        """Write every files collection to path, True when complete"""
+        self.action = 'exported'
+        part = self.path + '.part'
+        with open(part, 'wb') as f:
+            f.write(MAGIC)
+            for store, col in enumerate(cols):
+                for raw in col.find_raw_batches({}, batch_size=self.chunk_size):
+                    if self.cancelled:
+                        break
+                    self.write_chunk(f, store, raw)
+                    self.files += count_documents(raw)
+                    self.chunks += 1
+            if not self.cancelled:
+                f.write(CHUNK.pack(END_STORE, self.files, 0, 0, 0))
+        if self.cancelled:
+            os.remove(part)
+            return False
+        # a snapshot file is always complete
+        os.replace(part, self.path)
+        return True
+
+    def read_chunks(self, problems):
+        skipped = 0
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                problems.append('not a snapshot file')
+                return
+            while True:
+                header = f.read(CHUNK.size)
+                if len(header) < CHUNK.size:
+                    problems.append('snapshot is cut short, no end chunk')
+                    return
+                store, files, raw_size, size, crc = CHUNK.unpack(header)
+                if store == END_STORE:
+                    if files != self.files + skipped:
+                        problems.append(f'snapshot has {files} files, chunks have {self.files + skipped}')
+                    return
+                data = f.read(size)
+                self.chunks += 1
+                self.size += CHUNK.size + len(data)
+                raw = zlib.decompress(data) if len(data) == size and zlib.crc32(data) == crc else None
+                if raw is None or len(raw) != raw_size:
+                    problems.append(f'chunk {self.chunks} of store {store} is damaged, {files} files skipped')
+                    skipped += files
+                    continue
+                self.files += files
+                yield store, raw
+
+    def insert(self, col, raw):
+        try:
+            col.insert_many(decode_all(raw, RAW_DOCUMENTS), ordered=False)
+        except BulkWriteError as e:
+            # files already there from an earlier import
+            errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+            if errors:
+                raise
+
+    def import_files(self, cols):
+        """Bulk insert a snapshot, stores missing here go to the last one, returns a list of problems"""
+        self.action = 'imported'
+        problems = []
+        pending = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for store, raw in self.read_chunks(problems):
+                if self.cancelled:
+                    problems.append('cancelled')
+                    break
+                pending.append(pool.submit(self.insert, cols[min(store, len(cols) - 1)], raw))
+                if len(pending) >= self.workers * 2:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+        return problems
+
+    def summary(self):
+        seconds = time.monotonic() - self.started
+        return f'{self.files} files {self.action or "waiting"} in {self.chunks} chunks, {self.size // 1024 // 1024} MB, {seconds:.0f}s'
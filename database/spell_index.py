@@ -0,0 +1,129 @@
+import heapq
+import logging
+import threading
+from database.search_index import tokenize
+from database.query_regex import MAX_QUERY_WORDS
+
+logger = logging.getLogger(__name__)
+
+
+def edit_distance(a, b, max_distance):
+    """Damerau (optimal string alignment) distance, max_distance + 1 when it is over"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def deletes(word, max_distance):
+    """word and every string made by removing up to max_distance characters from it"""
+    found = {word}
+    level = [word]
+    for _ in range(max_distance):
+        next_level = []
+        for item in level:
+            for i in range(len(item)):
+                edit = item[:i] + item[i + 1:]
+                if edit not in found:
+                    found.add(edit)
+                    next_level.append(edit)
+        level = next_level
+    return found
+
+
+class SpellIndex:
+    """SymSpell style dictionary of file name words for offline spelling suggestions.
+
+    Every word is stored under all deletions of its prefix, a misspelled word
+    looks up its own deletions and only those few words get an edit distance check.
+    Numbers and very short words are left out, they are years, qualities and episodes.
+    """
+
+    def __init__(self, max_distance=2, prefix_length=6, min_length=3):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.min_length = min_length
+        self.ready = False
+        self.lock = threading.Lock()
+        self.words = {}
+        self.deletes = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, text):
+        with self.lock:
+            for word in set(tokenize(text)):
+                if len(word) < self.min_length or not word.isalpha():
+                    continue
+                count = self.words.get(word)
+                if count:
+                    self.words[word] = count + 1
+                    continue
+                self.words[word] = 1
+                for edit in deletes(word[:self.prefix_length], self.max_distance):
+                    # most deletes belong to one word, a list only when there are more
+                    words = self.deletes.get(edit)
+                    if words is None:
+                        self.deletes[edit] = word
+                    elif isinstance(words, str):
+                        self.deletes[edit] = [words, word]
+                    else:
+                        words.append(word)
+
+    def build(self, sources):
+        for store, col in sources:
+            for doc in col.find({}, {'file_name': 1}):
+                self.add(doc.get('file_name', ''))
+        self.ready = True
+        logger.info(f'Spell index loaded - {len(self)} words, {len(self.deletes)} deletes')
+
+    def lookup(self, word, limit=3):
+        """Closest known words as (word, distance, count), fewest edits then most files first"""
+        count = self.words.get(word)
+        if count or len(word) < self.min_length or not word.isalpha():
+            return [(word, 0, count or 0)]
+        # one typo allowed in short words, two get too many unrelated matches
+        max_distance = self.max_distance if len(word) > 4 else 1
+        prefix = word[:self.prefix_length]
+        found = {}
+        for edit in deletes(prefix, max_distance):
+            words = self.deletes.get(edit, ())
+            for suggestion in (words,) if isinstance(words, str) else words:
+                if suggestion in found:
+                    continue
+                distance = edit_distance(word, suggestion, max_distance)
+                if distance <= max_distance:
+                    found[suggestion] = distance
+        return heapq.nsmallest(limit, ((suggestion, distance, self.words[suggestion]) for suggestion, distance in found.items()),
+                               key=lambda item: (item[1], -item[2]))
+
+    def suggest(self, query, limit=10):
+        """Corrected queries, best first, the caller checks which of them have files"""
+        words = tokenize(query)[:MAX_QUERY_WORDS]
+        if not self.ready or not words:
+            return []
+        # beam over the words, a query that is not in the best limit + 1 so far
+        # can't be in them after more words, distance only grows and counts only drop
+        beam = [(0, float('-inf'), ())]
+        for word in words:
+            matches = self.lookup(word)
+            if not matches:
+                return []
+            beam = heapq.nsmallest(limit + 1, (
+                (distance + match_distance, max(rarest, -count), chosen + (match,))
+                for distance, rarest, chosen in beam
+                for match, match_distance, count in matches
+            ))
+        return [' '.join(chosen) for distance, rarest, chosen in beam if distance][:limit]
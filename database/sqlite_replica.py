@@ -0,0 +1,219 @@
+import logging
+import queue
+import sqlite3
+import threading
+from database.search_index import is_plain_query
+from database.query_regex import query_words
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+FIELDS = ('file_name', 'file_size', 'caption')
+TABLES = [
+    'CREATE TABLE IF NOT EXISTS files (num INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, store INTEGER NOT NULL, file_name TEXT NOT NULL, file_size INTEGER, caption TEXT)',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(file_name, caption, content='files', content_rowid='num')",
+    # the full text table keeps itself in step with files
+    'CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN '
+    'INSERT INTO files_fts(rowid, file_name, caption) VALUES (new.num, new.file_name, new.caption); END',
+    'CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN '
+    "INSERT INTO files_fts(files_fts, rowid, file_name, caption) VALUES ('delete', old.num, old.file_name, old.caption); END",
+    'CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF file_name, caption ON files BEGIN '
+    "INSERT INTO files_fts(files_fts, rowid, file_name, caption) VALUES ('delete', old.num, old.file_name, old.caption); "
+    'INSERT INTO files_fts(rowid, file_name, caption) VALUES (new.num, new.file_name, new.caption); END',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)'
+]
+UPSERT = ('INSERT INTO files (id, store, file_name, file_size, caption) VALUES (?, ?, ?, ?, ?) '
+          'ON CONFLICT(id) DO UPDATE SET store = excluded.store, file_name = excluded.file_name, '
+          'file_size = excluded.file_size, caption = excluded.caption')
+
+
+def chunks(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SqliteReplica:
+    """Read copy of all file collections in a local SQLite FTS5 database.
+
+    Filled by one full dump, then kept in step by the save, delete and move
+    hooks and an _id diff against mongo every sync. Searches and result pages
+    read from here, every write still goes to mongo first. The file stays on
+    disk, so after a restart searches use it before mongo answers.
+
+    The hooks only queue their writes, one writer thread applies them. Reads
+    use a connection per thread, in WAL mode they don't wait for the writer.
+    """
+
+    def __init__(self, path, use_caption=False):
+        self.path = path
+        self.use_caption = use_caption
+        self.lock = threading.Lock()
+        self.readers = threading.local()
+        self.writes = queue.Queue()
+        self.ready = False
+        self.added = 0
+        self.removed = 0
+        # files saved while the first dump runs, its cleanup keeps them
+        self.dumping = set()
+        try:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            with self.conn:
+                for table in TABLES:
+                    self.conn.execute(table)
+            self.ready = self.conn.execute("SELECT value FROM meta WHERE key = 'dumped'").fetchone() is not None
+        except sqlite3.Error as e:
+            # no FTS5 in this sqlite build, or the file can't be opened
+            logger.error(f'SQLite replica disabled - {e}')
+            self.conn = None
+            return
+        threading.Thread(target=self.write_queued, name='sqlite-replica', daemon=True).start()
+
+    def __len__(self):
+        if self.conn is None:
+            return 0
+        return self.reader().execute('SELECT count(*) FROM files').fetchone()[0]
+
+    def reader(self):
+        conn = getattr(self.readers, 'conn', None)
+        if conn is None:
+            conn = self.readers.conn = sqlite3.connect(self.path)
+        return conn
+
+    def write(self, sql, rows):
+        if self.conn is None:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(sql, rows)
+
+    def queue_write(self, sql, rows, missed):
+        if self.conn is not None:
+            self.writes.put((sql, rows, missed))
+
+    def write_queued(self):
+        while True:
+            sql, rows, missed = self.writes.get()
+            try:
+                self.write(sql, rows)
+            except sqlite3.Error as e:
+                logger.warning(f'SQLite replica missed {missed} - {e}')
+
+    def add(self, _id, file_name, file_size, caption, store=0):
+        if not self.ready:
+            self.dumping.add(_id)
+        self.queue_write(UPSERT, [(_id, store, file_name or '', file_size, caption)], 'a new file, next sync adds it')
+
+    def remove(self, ids):
+        for batch in chunks(list(ids)):
+            self.queue_write('DELETE FROM files WHERE id = ?', [(_id,) for _id in batch], 'deleted files, next sync removes them')
+
+    def move(self, ids, store):
+        self.queue_write('UPDATE files SET store = ? WHERE id = ?', [(store, _id) for _id in ids], 'moved files, next sync fixes them')
+
+    def upsert(self, docs, store):
+        self.write(UPSERT, [(doc['_id'], store, doc.get('file_name') or '', doc.get('file_size'), doc.get('caption')) for doc in docs])
+
+    def build(self, sources):
+        """Full dump the first time, an _id diff after that"""
+        if self.conn is None:
+            return
+        if self.ready:
+            self.sync(sources)
+            return
+        seen = set()
+        for store, col in sources:
+            batch = []
+            for doc in col.find({}, {field: 1 for field in FIELDS}):
+                if doc['_id'] in seen:
+                    continue
+                seen.add(doc['_id'])
+                batch.append(doc)
+                if len(batch) == BATCH_SIZE:
+                    self.upsert(batch, store)
+                    batch = []
+            self.upsert(batch, store)
+        local = [row[0] for row in self.reader().execute('SELECT id FROM files')]
+        # left over from a dump that was stopped
+        self.remove([_id for _id in local if _id not in seen and _id not in self.dumping])
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dumped', 1)")
+        self.ready = True
+        self.dumping = set()
+        logger.info(f'SQLite replica loaded - {len(seen)} files')
+
+    def sync(self, sources):
+        """Add files mongo has and the replica missed, drop the ones mongo lost"""
+        # read before mongo, a file saved in between is then seen as missing, never as gone
+        local = dict(self.reader().execute('SELECT id, store FROM files'))
+        remote = {}
+        for store, col in sources:
+            for doc in col.find({}, {'_id': 1}):
+                remote.setdefault(doc['_id'], store)
+
+        gone = [_id for _id in local if _id not in remote]
+        self.remove(gone)
+        added = 0
+        for store, col in sources:
+            missing = [_id for _id, where in remote.items() if where == store and _id not in local]
+            for batch in chunks(missing):
+                docs = list(col.find({'_id': {'$in': batch}}, {field: 1 for field in FIELDS}))
+                self.upsert(docs, store)
+                added += len(docs)
+            moved = [_id for _id, where in remote.items() if where == store and local.get(_id, store) != store]
+            self.move(moved, store)
+        self.added += added
+        self.removed += len(gone)
+        if added or gone:
+            logger.info(f'SQLite replica synced - {added} added, {len(gone)} removed')
+
+    def search(self, query, regex, match=None, limit=1000):
+        """Matching (_id, store), best first in every limit matches, or None when the query needs mongo"""
+        if not self.ready:
+            return None
+        words = query_words(query.lower()) if query else []
+        if not words or not is_plain_query(words):
+            return None
+        # one word is a whole word search, after that every word starts a token
+        terms = [f'"{words[0]}"'] if len(words) == 1 else [f'"{word}"*' for word in words[1:]]
+        if not self.use_caption:
+            terms = [f'file_name : {term}' for term in terms]
+        # like the other indexes only limit matches at a time are ranked, scoring
+        # every file that has a common word takes longer than the search itself
+        sql = ('SELECT files.id, files.store, files.file_name, files.caption FROM '
+               '(SELECT rowid, bm25(files_fts, 10.0, 1.0) AS score FROM files_fts WHERE files_fts MATCH ? LIMIT ? OFFSET ?) AS found '
+               'JOIN files ON files.num = found.rowid ORDER BY found.score')
+        ids = []
+        offset = 0
+        while True:
+            rows = self.reader().execute(sql, (' AND '.join(terms), limit, offset)).fetchall()
+            # full text only narrows down the files, the search regex decides
+            for _id, store, file_name, caption in rows:
+                if not (regex.search(file_name) or self.use_caption and caption and regex.search(caption)):
+                    continue
+                if match and not match(file_name):
+                    continue
+                ids.append((_id, store))
+                if len(ids) == limit:
+                    return ids
+            if len(rows) < limit:
+                return ids
+            offset += limit
+
+    def files(self, ids, fields):
+        """(doc, store) of the given _ids with the asked fields, unknown ids are left out"""
+        if not self.ready:
+            return []
+        columns = [field for field in FIELDS if field in fields]
+        results = []
+        for batch in chunks(list(ids)):
+            sql = f"SELECT {', '.join(['id', 'store'] + columns)} FROM files WHERE id IN ({', '.join('?' * len(batch))})"
+            for row in self.reader().execute(sql, batch):
+                doc = dict(zip(columns, row[2:]), _id=row[0])
+                results.append((doc, row[1]))
+        return results
+
+    def summary(self):
+        if not self.ready:
+            return 'replica loading'
+        return f'replica {len(self)} files, {self.added} added {self.removed} removed by sync'
@@ -0,0 +1,97 @@
+import logging
+import threading
+from array import array
+from database.search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class TrigramIndex:
+    """Trigrams of file name (and caption) tokens pointing to document numbers.
+
+    Used for substring and partial word searches that the text index can't answer,
+    it only gives candidates, mongo still checks them against the search regex.
+    """
+
+    def __init__(self, use_caption=False, max_candidates=5000):
+        self.use_caption = use_caption
+        self.max_candidates = max_candidates
+        self.ready = False
+        self.lock = threading.Lock()
+        self.ids = []
+        self.doc_nums = {}
+        self.removed = set()
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.doc_nums)
+
+    def add(self, _id, file_name, caption=None):
+        with self.lock:
+            if _id in self.doc_nums:
+                return False
+            self.removed.discard(_id)
+            num = len(self.ids)
+            self.ids.append(_id)
+            self.doc_nums[_id] = num
+            text = f'{file_name} {caption}' if self.use_caption and caption else str(file_name)
+            grams = set()
+            for token in tokenize(text):
+                grams.update(trigrams(token))
+            for gram in grams:
+                plist = self.postings.get(gram)
+                if plist is None:
+                    self.postings[gram] = array('I', [num])
+                else:
+                    plist.append(num)
+            return True
+
+    def remove(self, ids):
+        with self.lock:
+            for _id in ids:
+                num = self.doc_nums.pop(_id, None)
+                if num is None:
+                    if not self.ready:
+                        self.removed.add(_id)
+                    continue
+                self.ids[num] = None
+
+    def build(self, sources):
+        projection = {'file_name': 1, 'caption': 1} if self.use_caption else {'file_name': 1}
+        for store, col in sources:
+            for doc in col.find({}, projection):
+                if doc['_id'] in self.removed:
+                    continue
+                self.add(doc['_id'], doc.get('file_name', ''), doc.get('caption'))
+        self.removed.clear()
+        self.ready = True
+        logger.info(f'Trigram index loaded - {len(self)} files, {len(self.postings)} trigrams')
+
+    def candidates(self, words):
+        """_ids that contain every trigram of the query words, None when it can't narrow the search"""
+        if not self.ready:
+            return None
+        grams = set()
+        for word in words:
+            grams.update(trigrams(word))
+        if not grams:
+            return None
+        plists = []
+        for gram in grams:
+            plist = self.postings.get(gram)
+            if plist is None:
+                return []
+            plists.append(plist)
+        plists.sort(key=len)
+        nums = set(plists[0])
+        for plist in plists[1:]:
+            if not nums:
+                break
+            nums.intersection_update(plist)
+        if len(nums) > self.max_candidates:
+            return None
+        return [self.ids[num] for num in sorted(nums) if self.ids[num] is not None]
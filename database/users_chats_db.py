@@ -2,6 +2,7 @@ from pymongo import MongoClient
 from info import BOT_ID, ADMINS, DATABASE_NAME, DATA_DATABASE_URL, FILES_DATABASE_URL, SECOND_FILES_DATABASE_URL, IMDB_TEMPLATE, WELCOME_TEXT, LINK_MODE, TUTORIAL, FILE_CAPTION, IMDB, WELCOME, SPELL_CHECK, PROTECT_CONTENT, AUTO_DELETE, IS_STREAM, VERIFY_EXPIRE
 import time
 from datetime import datetime
+from database.executor import run_sync
 
 files_db_client = MongoClient(FILES_DATABASE_URL)
 files_db = files_db_client[DATABASE_NAME]
@@ -53,6 +54,7 @@ class Database:
         self.con = data_db.Connections
         self.stg = data_db.Settings
         self.scraped = data_db.ScrapedUrls  # For auto-scraper tracking
+        self.bot_sttgs = None  # read on every message, kept in memory to not block the loop
 
     def new_user(self, id, name):
         return dict(
@@ -78,14 +80,14 @@ class Database:
     
     async def add_user(self, id, name):
         user = self.new_user(id, name)
-        self.col.insert_one(user)
+        await run_sync(self.col.insert_one, user)
     
     async def is_user_exist(self, id):
-        user = self.col.find_one({'id':int(id)})
+        user = await run_sync(self.col.find_one, {'id':int(id)})
         return bool(user)
     
     async def total_users_count(self):
-        count = self.col.count_documents({})
+        count = await run_sync(self.col.count_documents, {})
         return count
     
     async def remove_ban(self, id):
@@ -93,21 +95,21 @@ class Database:
             is_banned=False,
             ban_reason=''
         )
-        self.col.update_one({'id': id}, {'$set': {'ban_status': ban_status}})
+        await run_sync(self.col.update_one, {'id': id}, {'$set': {'ban_status': ban_status}})
     
     async def ban_user(self, user_id, ban_reason="No Reason"):
         ban_status = dict(
             is_banned=True,
             ban_reason=ban_reason
         )
-        self.col.update_one({'id': user_id}, {'$set': {'ban_status': ban_status}})
+        await run_sync(self.col.update_one, {'id': user_id}, {'$set': {'ban_status': ban_status}})
 
     async def get_ban_status(self, id):
         default = dict(
             is_banned=False,
             ban_reason=''
         )
-        user = self.col.find_one({'id':int(id)})
+        user = await run_sync(self.col.find_one, {'id':int(id)})
         if not user:
             return default
         return user.get('ban_status', default)
@@ -116,10 +118,10 @@ class Database:
         return self.col.find({})
     
     async def delete_user(self, user_id):
-        self.col.delete_many({'id': int(user_id)})
+        await run_sync(self.col.delete_many, {'id': int(user_id)})
 
     async def delete_chat(self, grp_id):
-        self.grp.delete_many({'id': int(grp_id)})
+        await run_sync(self.grp.delete_many, {'id': int(grp_id)})
 
     def find_join_req(self, id):
         return bool(self.req.find_one({'id': id}))
@@ -131,18 +133,18 @@ class Database:
         self.req.drop()
 
     async def get_banned(self):
-        users = self.col.find({'ban_status.is_banned': True})
-        chats = self.grp.find({'chat_status.is_disabled': True})
+        users = await run_sync(lambda: list(self.col.find({'ban_status.is_banned': True})))
+        chats = await run_sync(lambda: list(self.grp.find({'chat_status.is_disabled': True})))
         b_chats = [chat['id'] for chat in chats]
         b_users = [user['id'] for user in users]
         return b_users, b_chats
     
     async def add_chat(self, chat, title):
         chat = self.new_group(chat, title)
-        self.grp.insert_one(chat)
+        await run_sync(self.grp.insert_one, chat)
 
     async def get_chat(self, chat):
-        chat = self.grp.find_one({'id':int(chat)})
+        chat = await run_sync(self.grp.find_one, {'id':int(chat)})
         return False if not chat else chat.get('chat_status')
     
     async def re_enable_chat(self, id):
@@ -150,13 +152,13 @@ class Database:
             is_disabled=False,
             reason="",
             )
-        self.grp.update_one({'id': int(id)}, {'$set': {'chat_status': chat_status}})
+        await run_sync(self.grp.update_one, {'id': int(id)}, {'$set': {'chat_status': chat_status}})
         
     async def update_settings(self, id, settings):
-        self.grp.update_one({'id': int(id)}, {'$set': {'settings': settings}})      
+        await run_sync(self.grp.update_one, {'id': int(id)}, {'$set': {'settings': settings}})      
     
     async def get_settings(self, id):
-        chat = self.grp.find_one({'id':int(id)})
+        chat = await run_sync(self.grp.find_one, {'id':int(id)})
         if chat:
             return chat.get('settings', self.default_setgs)
         return self.default_setgs
@@ -166,10 +168,10 @@ class Database:
             is_disabled=True,
             reason=reason,
             )
-        self.grp.update_one({'id': int(chat)}, {'$set': {'chat_status': chat_status}})
+        await run_sync(self.grp.update_one, {'id': int(chat)}, {'$set': {'chat_status': chat_status}})
     
     async def get_verify_status(self, user_id):
-        user = self.col.find_one({'id':int(user_id)})
+        user = await run_sync(self.col.find_one, {'id':int(user_id)})
         if user:
             info = user.get('verify_status', self.default_verify)
             try:
@@ -183,26 +185,26 @@ class Database:
         return self.default_verify
         
     async def update_verify_status(self, user_id, verify):
-        self.col.update_one({'id': int(user_id)}, {'$set': {'verify_status': verify}})
+        await run_sync(self.col.update_one, {'id': int(user_id)}, {'$set': {'verify_status': verify}})
     
     async def total_chat_count(self):
-        count = self.grp.count_documents({})
+        count = await run_sync(self.grp.count_documents, {})
         return count
     
     async def get_all_chats(self):
         return self.grp.find({})
     
     async def get_files_db_size(self):
-        return (files_db.command("dbstats"))['dataSize']
+        return (await run_sync(files_db.command, "dbstats"))['dataSize']
    
     async def get_second_files_db_size(self):
-        return (second_files_db.command("dbstats"))['dataSize']
+        return (await run_sync(second_files_db.command, "dbstats"))['dataSize']
     
     async def get_data_db_size(self):
-        return (data_db.command("dbstats"))['dataSize']
+        return (await run_sync(data_db.command, "dbstats"))['dataSize']
     
     async def get_all_chats_count(self):
-        grp = self.grp.count_documents({})
+        grp = await run_sync(self.grp.count_documents, {})
         return grp
     
     def get_plan(self, id):
@@ -241,12 +243,12 @@ class Database:
         if not self.stg.find_one({'id': BOT_ID}):
             self.stg.insert_one({'id': BOT_ID, var: val})
         self.stg.update_one({'id': BOT_ID}, {'$set': {var: val}})
+        self.bot_sttgs = None
 
     def get_bot_sttgs(self):
-        stg = self.stg.find_one({'id': BOT_ID})
-        if not stg:
-            return {}
-        return stg
+        if self.bot_sttgs is None:
+            self.bot_sttgs = self.stg.find_one({'id': BOT_ID}) or {}
+        return self.bot_sttgs
 
     # ============== SCRAPER METHODS ==============
     def is_scraped_url(self, url: str) -> bool:
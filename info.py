@@ -80,8 +80,17 @@ if len(FILES_DATABASE_URL) == 0:
 SECOND_FILES_DATABASE_URL = environ.get('SECOND_FILES_DATABASE_URL', "")
 if len(SECOND_FILES_DATABASE_URL) == 0:
     logger.info('SECOND_FILES_DATABASE_URL is empty')
+EXTRA_FILES_DATABASE_URLS = environ.get('EXTRA_FILES_DATABASE_URLS', '').split() # more files databases after the second one
+FILES_DATABASE_URLS = [url for url in [FILES_DATABASE_URL, SECOND_FILES_DATABASE_URL] + EXTRA_FILES_DATABASE_URLS if url]
+FILES_DB_SIZE_LIMIT = int(environ.get('FILES_DB_SIZE_LIMIT', 512)) # MB, size of one files database
 DATABASE_NAME = environ.get('DATABASE_NAME', "Cluster0")
+DB_WORKERS = int(environ.get('DB_WORKERS', 8)) # threads for database calls
+DB_BACKGROUND_WORKERS = int(environ.get('DB_BACKGROUND_WORKERS', 4)) # threads for index builds, backfills, migrations and snapshots
+DB_TIMEOUT = int(environ.get('DB_TIMEOUT', 30)) # Add time in seconds
 COLLECTION_NAME = environ.get('COLLECTION_NAME', 'Files')
+SEARCH_BACKEND = environ.get('SEARCH_BACKEND', 'mongo').lower() # mongo, memory or mmap
+SEARCH_INDEX_PATH = environ.get('SEARCH_INDEX_PATH', 'search_index.bin') # index file of the mmap backend
+SQLITE_REPLICA = environ.get('SQLITE_REPLICA', '') # path of a local sqlite copy of the files for searches, empty to disable
 
 # Links
 SUPPORT_LINK = environ.get('SUPPORT_LINK', 'https://t.me/sinhalasubsproject')
@@ -95,6 +104,10 @@ TIME_ZONE = environ.get('TIME_ZONE', 'Asia/Colombo') # Replace your time zone
 DELETE_TIME = int(environ.get('DELETE_TIME', 3600)) # Add time in seconds
 CACHE_TIME = int(environ.get('CACHE_TIME', 300))
 MAX_BTN = int(environ.get('MAX_BTN', 8))
+SEARCH_COUNT_LIMIT = int(environ.get('SEARCH_COUNT_LIMIT', 1000)) # stop counting search results after this
+SEARCH_CACHE_SIZE = int(environ.get('SEARCH_CACHE_SIZE', 500)) # max cached searches, 0 to disable
+SEARCH_CACHE_TTL = int(environ.get('SEARCH_CACHE_TTL', 300)) # Add time in seconds
+SEARCH_RANK_LIMIT = int(environ.get('SEARCH_RANK_LIMIT', 100)) # best results moved to first pages, 0 to disable
 LANGUAGES = [language.lower() for language in environ.get('LANGUAGES', 'hindi english telugu tamil kannada malayalam marathi punjabi').split()]
 QUALITY = [quality.lower() for quality in environ.get('QUALITY', '360p 480p 720p 1080p 2160p').split()]
 IMDB_TEMPLATE = environ.get("IMDB_TEMPLATE", script.IMDB_TEMPLATE)
@@ -114,6 +127,10 @@ LONG_IMDB_DESCRIPTION = is_enabled("LONG_IMDB_DESCRIPTION", False)
 LINK_MODE = is_enabled("LINK_MODE", False)
 IMDB = is_enabled('IMDB', True)
 SPELL_CHECK = is_enabled("SPELL_CHECK", True)
+TRIGRAM_INDEX = is_enabled('TRIGRAM_INDEX', False)
+PREFIX_INDEX = is_enabled('PREFIX_INDEX', False)
+SPELL_INDEX = is_enabled('SPELL_INDEX', False)
+COMPACT_SCHEMA = is_enabled('COMPACT_SCHEMA', False)
 
 # TMDB API (optional - if set, uses TMDB instead of IMDB for movie info and posters)
 # Get free API key from https://www.themoviedb.org/settings/api
@@ -0,0 +1,60 @@
+"""Copy or move files between files databases without the bot running.
+
+python migrate.py FROM TO [--copy] [--rate FILES_PER_SECOND] [--limit FILES] [--batch FILES]
+
+Database numbers are the order of FILES_DATABASE_URL, SECOND_FILES_DATABASE_URL
+and EXTRA_FILES_DATABASE_URLS, starting at 0. A stopped migration continues
+from its last batch when started again. Restart the bot after moving files.
+"""
+import time
+import logging
+import argparse
+from pymongo import MongoClient
+from info import FILES_DATABASE_URLS, DATABASE_NAME, COLLECTION_NAME
+from database.migration import StoreMigration
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy or move files between files databases')
+    parser.add_argument('source', type=int)
+    parser.add_argument('target', type=int)
+    parser.add_argument('--copy', action='store_true', help='keep files in the source database')
+    parser.add_argument('--rate', type=int, default=0, help='files per second, 0 for no limit')
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many files')
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    stores = range(len(FILES_DATABASE_URLS))
+    if args.source == args.target or args.source not in stores or args.target not in stores:
+        parser.error(f'source and target must be two different numbers from 0 to {len(FILES_DATABASE_URLS) - 1}')
+    source = MongoClient(FILES_DATABASE_URLS[args.source])[DATABASE_NAME][COLLECTION_NAME]
+    target = MongoClient(FILES_DATABASE_URLS[args.target])[DATABASE_NAME][COLLECTION_NAME]
+    migration = StoreMigration(source, target, args.source, args.target, move=not args.copy,
+                               batch_size=args.batch, rate=args.rate, limit=args.limit)
+
+    start = time.monotonic()
+    last_log = start
+    def on_batch(ids):
+        nonlocal last_log
+        if time.monotonic() - last_log >= 10:
+            last_log = time.monotonic()
+            logger.info(f'{migration.summary()} - {migration.copied / (last_log - start):.0f} files/s')
+
+    try:
+        finished = migration.run(on_batch)
+    except KeyboardInterrupt:
+        logger.info(f'Stopped - {migration.summary()}, run again to continue')
+        return
+    logger.info(f"{'Completed' if finished else 'Stopped'} - {migration.summary()} in {time.monotonic() - start:.0f}s")
+    problems = migration.verify()
+    for problem in problems:
+        logger.error(problem)
+    if not problems:
+        logger.info('All files checked')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,8 @@ import datetime
 from Script import script
 from hydrogram import Client, filters, enums
 from hydrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from database.ia_filterdb import db_count_documents, second_db_count_documents, get_file_details, delete_files
+from database.ia_filterdb import db_count_documents, second_db_count_documents, get_file_details, delete_files, count_delete_matches, get_search_stats, load_captions, get_migration, run_migration, export_snapshot, import_snapshot
+from database.snapshot import Snapshot
 from database.users_chats_db import db
 from datetime import datetime, timedelta
 from info import IS_PREMIUM, PRE_DAY_AMOUNT, RECEIPT_SEND_USERNAME, URL, BIN_CHANNEL, SECOND_FILES_DATABASE_URL, STICKERS, INDEX_CHANNELS, ADMINS, IS_VERIFY, VERIFY_TUTORIAL, VERIFY_EXPIRE, DELETE_TIME, SUPPORT_LINK, UPDATES_LINK, LOG_CHANNEL, PICS, IS_STREAM, REACTIONS, PM_FILE_DELETE_TIME
@@ -114,6 +115,7 @@ async def start(client, message):
         if not files:
             return await message.reply('No Such All Files Exist!')
         settings = await get_settings(int(grp_id))
+        await load_captions(files)
         file_ids = []
         total_files = await message.reply(f"<b><i>🗂 Total files - <code>{len(files)}</code></i></b>")
         for file in files:
@@ -208,7 +210,7 @@ async def stats(bot, message):
         secnd_files = '-'
 
     uptime = get_readable_time(time_now() - temp.START_TIME)
-    await message.reply_text(script.STATUS_TXT.format(users, chats, used_data_db_size, files, used_files_db_size, secnd_files, secnd_files_db_used_size, uptime))    
+    await message.reply_text(script.STATUS_TXT.format(users, chats, used_data_db_size, files, used_files_db_size, secnd_files, secnd_files_db_used_size, uptime, get_search_stats()))    
     
 
 
@@ -287,15 +289,114 @@ async def delete_file(bot, message):
         query = message.text.split(" ", 1)[1]
     except:
         return await message.reply_text("Command Incomplete!\nUsage: /delete query")
+    msg = await message.reply_text("Counting files...")
+    total, names = await count_delete_matches(query)
+    if not total:
+        return await msg.edit(f"No files found for: {query}")
+    preview = '\n'.join(f'- <code>{name}</code>' for name in names)
     btn = [[
         InlineKeyboardButton("YES", callback_data=f"delete_{query}")
     ],[
         InlineKeyboardButton("CLOSE", callback_data="close_data")
     ]]
-    await message.reply_text(f"Do you want to delete all: {query} ?", reply_markup=InlineKeyboardMarkup(btn))
+    await msg.edit(f"Found {total} files for: {query}\n{preview}\n\nDo you want to delete all of them?", reply_markup=InlineKeyboardMarkup(btn))
  
 
 
+@Client.on_message(filters.command('migrate') & filters.user(ADMINS))
+async def migrate_files(bot, message):
+    args = message.command[1:]
+    if args == ['cancel']:
+        if not temp.MIGRATION:
+            return await message.reply('No migration is running.')
+        temp.MIGRATION.cancelled = True
+        return await message.reply('Trying to cancel migration...')
+    if temp.MIGRATION:
+        return await message.reply('Wait until previous migration complete.')
+    usage = 'Usage: /migrate from_db to_db [move|copy] [files per second]\nExample: /migrate 0 2 move 500\nStop it with /migrate cancel, run it again to continue.'
+    try:
+        source, target = int(args[0]), int(args[1])
+        move = (args[2] if len(args) > 2 else 'move') == 'move'
+        rate = int(args[3]) if len(args) > 3 else 0
+        migration = get_migration(source, target, move=move, rate=rate)
+    except IndexError:
+        return await message.reply(usage)
+    except ValueError as e:
+        return await message.reply(f'{e}\n\n{usage}')
+
+    temp.MIGRATION = migration
+    msg = await message.reply(f'Starting migration {migration.name}...')
+    task = asyncio.create_task(run_migration(migration, target))
+    try:
+        while not task.done():
+            await asyncio.sleep(10)
+            try:
+                await msg.edit(f'Migrating... {migration.summary()}')
+            except Exception:
+                pass
+        finished, problems = await task
+    except Exception as e:
+        return await msg.edit(f'Migration stopped due to Error - {e}\n{migration.summary()}, run it again to continue.')
+    finally:
+        temp.MIGRATION = None
+    status = 'Completed' if finished else 'Stopped, run it again to continue'
+    check = '\n'.join(problems) if problems else 'All files checked.'
+    await msg.edit(f'{status}!\n{migration.summary()}\n\n{check}')
+
+
+
+@Client.on_message(filters.command('snapshot') & filters.user(ADMINS))
+async def snapshot_files(bot, message):
+    args = message.command[1:]
+    if args == ['cancel']:
+        if not temp.SNAPSHOT:
+            return await message.reply('No snapshot is running.')
+        temp.SNAPSHOT.cancelled = True
+        return await message.reply('Trying to cancel snapshot...')
+    if temp.SNAPSHOT:
+        return await message.reply('Wait until previous snapshot complete.')
+    usage = 'Usage: /snapshot export\nor reply /snapshot import to a snapshot file\nStop it with /snapshot cancel.'
+    if args not in (['export'], ['import']):
+        return await message.reply(usage)
+    if args == ['import'] and not (message.reply_to_message and message.reply_to_message.document):
+        return await message.reply(usage)
+
+    msg = await message.reply('Downloading snapshot...' if args == ['import'] else 'Starting snapshot...')
+    if args == ['export']:
+        path = f'files_{datetime.now().strftime("%Y%m%d_%H%M")}.snap'
+    else:
+        path = await message.reply_to_message.download()
+    snapshot = Snapshot(path)
+    temp.SNAPSHOT = snapshot
+    task = asyncio.create_task(export_snapshot(snapshot) if args == ['export'] else import_snapshot(snapshot))
+    try:
+        while not task.done():
+            await asyncio.sleep(10)
+            try:
+                await msg.edit(f'Working... {snapshot.summary()}')
+            except Exception:
+                pass
+        result = await task
+    except Exception as e:
+        return await msg.edit(f'Snapshot stopped due to Error - {e}\n{snapshot.summary()}')
+    finally:
+        temp.SNAPSHOT = None
+
+    try:
+        if args == ['export']:
+            if not result:
+                return await msg.edit(f'Cancelled!\n{snapshot.summary()}')
+            await msg.edit(f'Uploading...\n{snapshot.summary()}')
+            await message.reply_document(path, caption=f'{snapshot.summary()}\nReply /snapshot import to this file in the new bot.')
+            await msg.delete()
+        else:
+            check = '\n'.join(result) if result else 'All chunks checked.'
+            await msg.edit(f'Completed!\n{snapshot.summary()}\n\n{check}\n\nRestart the bot to load the new files in searches.')
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
 @Client.on_message(filters.command('ping'))
 async def ping(client, message):
     start_time = monotonic()
@@ -1,14 +1,15 @@
-import re
 import time
 import asyncio
 from hydrogram import Client, filters, enums
 from hydrogram.errors import FloodWait
 from info import ADMINS, INDEX_EXTENSIONS
-from database.ia_filterdb import save_file
+from database.ia_filterdb import save_files
 from hydrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from utils import temp, get_readable_time
 
 lock = asyncio.Lock()
+# files saved with one insert_many
+BATCH_SIZE = 200
 
 @Client.on_callback_query(filters.regex(r'^index'))
 async def index_files(bot, query):
@@ -84,6 +85,19 @@ async def index_files_to_db(lst_msg_id, chat, msg, bot, skip):
     unsupported = 0
     badfiles = 0
     current = skip
+    batch = []
+
+    async def save_batch():
+        nonlocal total_files, duplicate, errors
+        results = await save_files(batch)
+        batch.clear()
+        for sts, store in results:
+            if sts == 'suc':
+                total_files += 1
+            elif sts == 'dup':
+                duplicate += 1
+            elif sts == 'err':
+                errors += 1
     
     async with lock:
         try:
@@ -91,6 +105,8 @@ async def index_files_to_db(lst_msg_id, chat, msg, bot, skip):
                 time_taken = get_readable_time(time.time()-start_time)
                 if temp.CANCEL:
                     temp.CANCEL = False
+                    if batch:
+                        await save_batch()
                     await msg.edit(f"Successfully Cancelled!\nCompleted in {time_taken}\n\nSaved <code>{total_files}</code> files to Database!\nDuplicate Files Skipped: <code>{duplicate}</code>\nDeleted Messages Skipped: <code>{deleted}</code>\nNon-Media messages skipped: <code>{no_media + unsupported}</code>\nUnsupported Media: <code>{unsupported}</code>\nErrors Occurred: <code>{errors}</code>\nBad Files Ignoref: <code>{badfiles}</code>")
                     return
                 current += 1
@@ -119,14 +135,11 @@ async def index_files_to_db(lst_msg_id, chat, msg, bot, skip):
                     unsupported += 1
                     continue
                 media.caption = message.caption
-                file_name = re.sub(r"@\w+|(_|\-|\.|\+)", " ", str(media.file_name))
-                sts = await save_file(media)
-                if sts == 'suc':
-                    total_files += 1
-                elif sts == 'dup':
-                    duplicate += 1
-                elif sts == 'err':
-                    errors += 1
+                batch.append(media)
+                if len(batch) >= BATCH_SIZE:
+                    await save_batch()
+            if batch:
+                await save_batch()
         except Exception as e:
             await msg.reply(f'Index canceled due to Error - {e}')
         else:
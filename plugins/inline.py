@@ -1,6 +1,6 @@
 from hydrogram import Client
 from hydrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultCachedDocument, InlineQuery
-from database.ia_filterdb import get_search_results
+from database.ia_filterdb import get_inline_results
 from utils import get_size, temp, get_verify_status, is_subscribed, is_premium, clean_ascii, remove_urls
 from info import CACHE_TIME, SUPPORT_LINK, UPDATES_LINK, FILE_CAPTION, IS_VERIFY
 
@@ -41,7 +41,7 @@ async def inline_search(bot, query):
     results = []
     string = query.query
     offset = int(query.offset or 0)
-    files, next_offset, total = await get_search_results(string, offset=offset)
+    files, next_offset, total = await get_inline_results(string, offset=offset)
 
     for file in files:
         reply_markup = get_reply_markup(string)
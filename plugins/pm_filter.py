@@ -12,11 +12,12 @@ from hydrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Callback
 from hydrogram import Client, filters, enums
 from utils import is_premium, get_size, is_subscribed, is_check_admin, get_wish, get_readable_time, get_poster, temp, get_settings, save_group_settings, clean_ascii
 from database.users_chats_db import db
-from database.ia_filterdb import get_search_results,delete_files, db_count_documents, second_db_count_documents
+from database.ia_filterdb import get_search_results, delete_files, db_count_documents, second_db_count_documents, get_search_stats, get_spell_suggestions
 from plugins.commands import get_grp_stg
 
 BUTTONS = {}
 CAP = {}
+SUGGESTIONS = {}
 
 @Client.on_message(filters.private & filters.text & filters.incoming)
 async def pm_search(client, message):
@@ -196,6 +197,26 @@ async def advantage_spoll_choker(bot, query):
         except:
             pass
 
+@Client.on_callback_query(filters.regex(r"^suggest"))
+async def suggestion_choker(bot, query):
+    _, i, user = query.data.split('#')
+    if int(user) != 0 and query.from_user.id != int(user):
+        return await query.answer(f"Hello {query.from_user.first_name},\nDon't Click Other Results!", show_alert=True)
+    try:
+        search = SUGGESTIONS[f"{query.message.chat.id}-{query.message.reply_to_message.id}"][int(i)]
+    except:
+        return await query.answer("This suggestion is old, search again.", show_alert=True)
+    s = await query.message.edit_text(f"<b><i><code>{search}</code> Check In My Database...</i></b>")
+    await query.answer('')
+    files, offset, total_results = await get_search_results(search)
+    if files:
+        k = (search, files, offset, total_results)
+        await auto_filter(bot, query, s, k)
+    else:
+        k = await query.message.edit(f"👋 Hello {query.from_user.mention},\n\nI don't find <b>'{search}'</b> in my database. 😔")
+        await asyncio.sleep(60)
+        await k.delete()
+
 @Client.on_callback_query()
 async def cb_handler(client: Client, query: CallbackQuery):
     if query.data == "close_data":
@@ -308,7 +329,7 @@ async def cb_handler(client: Client, query: CallbackQuery):
             InlineKeyboardButton('« ʙᴀᴄᴋ', callback_data='about')
         ]]
         await query.edit_message_media(
-            InputMediaPhoto(random.choice(PICS), caption=script.STATUS_TXT.format(users, chats, used_data_db_size, files, used_files_db_size, secnd_files, secnd_files_db_used_size, uptime)),
+            InputMediaPhoto(random.choice(PICS), caption=script.STATUS_TXT.format(users, chats, used_data_db_size, files, used_files_db_size, secnd_files, secnd_files_db_used_size, uptime, get_search_stats())),
             reply_markup=InlineKeyboardMarkup(buttons)
         )
     
@@ -607,9 +628,37 @@ async def cb_handler(client: Client, query: CallbackQuery):
 
     elif query.data.startswith("delete"):
         _, query_ = query.data.split("_", 1)
-        await query.message.edit('Deleting...')
-        deleted = await delete_files(query_)
-        await query.message.edit(f'Deleted {deleted} files in your database in your query {query_}')
+        if query.from_user.id not in ADMINS:
+            return await query.answer("ADMINS Only!", show_alert=True)
+        temp.DELETE_CANCEL = False
+        btn = [[
+            InlineKeyboardButton('CANCEL', callback_data='cancel_delete')
+        ]]
+        await query.message.edit('Deleting...', reply_markup=InlineKeyboardMarkup(btn))
+        last_edit = time_now()
+
+        async def progress(deleted):
+            nonlocal last_edit
+            if time_now() - last_edit < 10:
+                return
+            last_edit = time_now()
+            try:
+                await query.message.edit(f'Deleting... {deleted} files deleted in your query {query_}', reply_markup=InlineKeyboardMarkup(btn))
+            except:
+                pass
+
+        deleted = await delete_files(query_, progress, lambda: temp.DELETE_CANCEL)
+        if temp.DELETE_CANCEL:
+            temp.DELETE_CANCEL = False
+            await query.message.edit(f'Cancelled! Deleted {deleted} files in your database in your query {query_}')
+        else:
+            await query.message.edit(f'Deleted {deleted} files in your database in your query {query_}')
+
+    elif query.data == "cancel_delete":
+        if query.from_user.id not in ADMINS:
+            return await query.answer("ADMINS Only!", show_alert=True)
+        temp.DELETE_CANCEL = True
+        await query.answer("Trying to cancel deleting...")
      
     elif query.data.startswith("send_all"):
         ident, key, req = query.data.split("#")
@@ -815,6 +864,29 @@ async def advantage_spell_chok(message, s):
         InlineKeyboardButton("⚠️ Instructions ⚠️", callback_data='instructions'),
         InlineKeyboardButton("🔎 Search Google 🔍", url=f"https://www.google.com/search?q={google_search}")
     ]]
+    user = message.from_user.id if message.from_user else 0
+    # our own file names first, imdb only when they have nothing close
+    suggestions = await get_spell_suggestions(search)
+    if suggestions:
+        key = f"{message.chat.id}-{message.id}"
+        SUGGESTIONS[key] = suggestions
+        buttons = [[
+            InlineKeyboardButton(text=suggestion.title(), callback_data=f"suggest#{i}#{user}")
+        ]
+            for i, suggestion in enumerate(suggestions)
+        ]
+        buttons.append(
+            [InlineKeyboardButton("🚫 ᴄʟᴏsᴇ 🚫", callback_data="close_data")]
+        )
+        s = await s.edit_text(text=f"👋 Hello {message.from_user.mention},\n\nI couldn't find the <b>'{search}'</b> you requested.\nSelect if you meant one of these? 👇", reply_markup=InlineKeyboardMarkup(buttons))
+        await asyncio.sleep(300)
+        SUGGESTIONS.pop(key, None)
+        await s.delete()
+        try:
+            await message.delete()
+        except:
+            pass
+        return
     try:
         movies = await get_poster(search, bulk=True)
     except:
@@ -837,7 +909,6 @@ async def advantage_spell_chok(message, s):
             pass
         return
     movies = list(dict.fromkeys(movies))
-    user = message.from_user.id if message.from_user else 0
     buttons = [[
         InlineKeyboardButton(text=movie.get('title'), callback_data=f"spolling#{movie.movieID}#{user}")
     ]
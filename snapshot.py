@@ -0,0 +1,49 @@
+"""Export files databases to a snapshot file, or import one, without the bot running.
+
+python snapshot.py export PATH [--chunk FILES]
+python snapshot.py import PATH [--workers THREADS]
+
+An import puts the files of each database in the database with the same
+number, files of numbers this bot doesn't have go to the last one. Files
+already saved are skipped, so a stopped import can be started again.
+Restart the bot after importing files.
+"""
+import logging
+import argparse
+from pymongo import MongoClient
+from info import FILES_DATABASE_URLS, DATABASE_NAME, COLLECTION_NAME
+from database.snapshot import Snapshot
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export or import files databases as one snapshot file')
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('path')
+    parser.add_argument('--chunk', type=int, default=1000, help='files in one compressed chunk')
+    parser.add_argument('--workers', type=int, default=4, help='import threads')
+    args = parser.parse_args()
+
+    cols = [MongoClient(url)[DATABASE_NAME][COLLECTION_NAME] for url in FILES_DATABASE_URLS]
+    snapshot = Snapshot(args.path, chunk_size=args.chunk, workers=args.workers)
+    try:
+        if args.action == 'export':
+            snapshot.export_files(cols)
+            logger.info(f'Completed - {snapshot.summary()}')
+            return
+        problems = snapshot.import_files(cols)
+    except KeyboardInterrupt:
+        snapshot.cancelled = True
+        logger.info(f'Stopped - {snapshot.summary()}')
+        return
+    logger.info(f'Completed - {snapshot.summary()}')
+    for problem in problems:
+        logger.error(problem)
+    if not problems:
+        logger.info('All chunks checked')
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,9 @@ class temp(object):
     GROUPS_CANCEL = False
     BOT = None
     PREMIUM = {}
+    MIGRATION = None
+    SNAPSHOT = None
+    DELETE_CANCEL = False
 
 async def is_subscribed(bot, query):
     btn = []